@@ -1,10 +1,14 @@
 """
 """
 
+import os
 from argparse import ArgumentParser
-from plotting import plot_population, plot_poll, plot_single_poll, plot_polls, plot_multiple_polls
+from plotting import plot_population, plot_poll, plot_single_poll, plot_live, plot_polls, plot_multiple_polls
 from random import seed
-from polling import Population
+from elections import parties, party_color
+from results import load as load_results
+from cache import SimulationCache
+from prefetch import FrameQueue
 
 
 # Parse command line arguments
@@ -21,9 +25,23 @@ parser.add_argument("-t", "--tallies", default=500, type=int, help="Number of ta
 parser.add_argument("-p", "--polls", default=600, type=int, help="Number of polls")
 parser.add_argument("-a", "--alpha", default=0.95, type=float, help="Significance level")
 parser.add_argument("-r", "--replace", action="store_true", help="Sample with replacement")
+parser.add_argument("-m", "--margin", default=None, type=float, help="Stop polling once the error margin of every group is below this, asking at most --voters voters")
+parser.add_argument("-d", "--density", action="store_true", help="Plot the polls as one density image per group, for very many polls")
+parser.add_argument("-w", "--workers", default=None, type=int, help="Simulate polls, and render saved animations, over this many processes")
+parser.add_argument("--store", default=None, help="Store the simulated counts in this result file")
+parser.add_argument("--load", default=None, help="Plot the counts of this result file instead of simulating")
+parser.add_argument("--cache", default=None, help="Cache simulations in this directory")
+parser.add_argument("--cache-budget", default=1024, type=int, help="Size limit of the cache in MB")
+parser.add_argument("--instrument", nargs="?", const="-", default=os.environ.get("POLLING_INSTRUMENT"), help="Time the sampling and plotting stages, and print a summary at exit (or write it to a .json file)")
+parser.add_argument("--live", default=None, help="Animate the live count of the district updates from host:port or a file (e.g. served by live.py), out of --voters votes")
+parser.add_argument("--prefetch", default=None, type=int, help="Simulate the counting animation ahead in the background, queueing up to this many tallies")
 
 options = parser.parse_args()
 
+if options.instrument:
+    import instrument
+    instrument.enable(options.instrument)
+
 # Set seed
 seed(options.seed)
 
@@ -35,35 +53,31 @@ _kwargs = dict(
     tallies             = options.tallies,
     polls               = options.polls,
     alpha               = options.alpha,
+    workers             = options.workers,
+    seed                = options.seed,
+    store               = options.store,
+    cache               = options.cache and SimulationCache(options.cache, options.cache_budget << 20),
+    margin              = options.margin,
+    density             = options.density,
+    prefetch            = options.prefetch and FrameQueue(options.prefetch),
 )
 
+population, group_color = parties, party_color
+
+if options.load:
+    counts, meta = load_results(options.load)
+    population = meta.pop("population")
+    group_color = {group: party_color.get(group, "#808080") for group in population}
+
+    # tallies are shown by the poll animation, polls by the polls plots
+    if meta.pop("kind") == "tallies":
+        options.plot, options.animate = "poll", True
+    elif options.plot != "polls":
+        options.plot = "polls"
+
+    _kwargs.update(meta, counts=counts, store=None)
 
 
-# Stortingsvalgresultat 2017
-parties = Population({
-    "R"   :  70_522,
-    "SV"  : 175_222,
-    "AP"  : 800_947,
-    "SP"  : 302_017,
-    "MDG" :  94_788,
-    "KRF" : 122_797,
-    "V"   : 127_910,
-    "H"   : 732_895,
-    "FRP" : 444_681,
-})
-
-# colours from https://www.nrk.no/valg/2017/resultat/
-party_color = {
-    "R"   : "#990014",
-    "SV"  : "#d94abf",
-    "AP"  : "#e51c30",
-    "SP"  : "#a5cd39",
-    "MDG" : "#3d8704",
-    "KRF" : "#f0b618",
-    "V"   : "#24b38c",
-    "H"   : "#00b9f2",
-    "FRP" : "#005799",
-}
 
 from inspect import signature
 params = lambda foo: signature(foo).parameters.keys()
@@ -71,14 +85,24 @@ kwargs = lambda foo: {k: _kwargs[k] for k in params(foo) & _kwargs.keys()}
 
 
 if options.plot == "population":
-    plot_population(parties, party_color, save=options.save)
+    plot_population(population, group_color, save=options.save)
 if options.plot == "poll":
     if not options.animate:
-        plot_poll(parties, party_color, **kwargs(plot_poll), save=options.save)
+        plot_poll(population, group_color, **kwargs(plot_poll), save=options.save)
     else:
-        plot_single_poll(parties, party_color, **kwargs(plot_single_poll), save=options.save)
+        plot_single_poll(population, group_color, **kwargs(plot_single_poll), save=options.save)
 if options.plot == "polls":
     if not options.animate:
-        plot_polls(parties, party_color, **kwargs(plot_polls), save=options.save)
+        plot_polls(population, group_color, **kwargs(plot_polls), save=options.save)
     else:
-        plot_multiple_polls(parties, party_color, **kwargs(plot_multiple_polls), save=options.save)
+        plot_multiple_polls(population, group_color, **kwargs(plot_multiple_polls), save=options.save)
+if options.live:
+    plot_live(population, group_color, options.live, **kwargs(plot_live))
+
+from sys import stderr
+
+if _kwargs["prefetch"] is not None:
+    print("prefetch: {depth} of {maxsize} queued, {produced} simulated, {consumed} shown, {starved} frames starved, {blocked} tallies blocked".format(**_kwargs["prefetch"].stats()), file=stderr)
+
+if _kwargs["cache"] is not None:
+    print("cache: {hits} hits, {misses} misses, {bytes} of {budget} bytes".format(**_kwargs["cache"].stats()), file=stderr)
@@ -0,0 +1,216 @@
+"""
+Benchmark the sampling engines and the plots, and compare against a baseline
+
+    python bench.py -o bench.json                  # run the full grid
+    python bench.py --quick -b bench.json          # compare, exit 1 on a regression
+    python bench.py -k poll -g 3 50 -v 1000        # a part of the grid
+
+The plots are drawn headless on Agg. Every benchmark is repeated until it has
+run for --min-time seconds, and the fastest run counts. The results are json:
+
+    {"meta": {...}, "results": {"poll[groups=50,voters=10000,replace=False]": {"seconds": ..., "rate": ..., "unit": "ballots/s"}, ...}}
+"""
+
+import json
+import platform
+import warnings
+from itertools import product
+from time import perf_counter
+
+import numpy as np
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt
+
+from polling import Population, Accumulator, votes, poll, poll_batch, Tally, sigma, error
+
+
+GROUPS = (3, 50, 5000)
+VOTERS = (10**2, 10**4, 10**7)
+QUICK_GROUPS = (3, 50)
+QUICK_VOTERS = (10**2, 10**4)
+
+# votes() yields one ballot at a time, and would take minutes at the largest sizes
+VOTES_LIMIT = 10**6
+
+
+
+def population_of(groups, size, seed=0):
+    """
+    Return a population of {groups} groups with random weights summing to {size}
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(size - groups, rng.dirichlet(np.ones(groups))) + 1
+    return Population({f"g{i}" : int(weight) for i, weight in enumerate(weights)})
+
+
+def colors_of(population, seed=0):
+    rng = np.random.default_rng(seed)
+    return {group : "#%02x%02x%02x" % tuple(rng.integers(256, size=3)) for group in population}
+
+
+
+def timed(function, min_time):
+    """
+    Return the fastest of the runs of {function} within {min_time} seconds (at least one)
+    """
+    best, total = np.inf, 0.0
+    while total < min_time or best == np.inf:
+        start = perf_counter()
+        function()
+        seconds = perf_counter() - start
+
+        best, total = min(best, seconds), total + seconds
+    return best
+
+
+
+def cases(groups, voters, replacement):
+    """
+    Yield (name, prepare, work, unit) for every benchmark of the grid, where
+    prepare() sets the benchmark up and returns the function to time, which
+    does {work} units per call
+    """
+    import plotting
+
+    for g, n, replace in product(groups, voters, replacement):
+        # without replacement the population has to hold the poll
+        population = population_of(g, 10 * max(n, g))
+        colors = colors_of(population)
+        params = f"groups={g},voters={n},replace={replace}"
+        tallies = min(500, n)
+
+        p = population.probabilities
+        N = np.inf if replace else population.size
+
+        if n <= VOTES_LIMIT:
+            yield f"votes[{params}]", ready(lambda: sum(1 for _ in votes(population, n, not replace))), n, "ballots/s"
+        yield f"poll[{params}]", ready(lambda: poll(population, n, not replace, codes=True)), n, "ballots/s"
+        yield f"Tally[{params},tallies={tallies}]", ready(lambda: sum(1 for _ in Tally(population, n, tallies, not replace, codes=True))), n, "ballots/s"
+        yield f"error[{params}]", ready(lambda: error(p, n, N)), g, "groups/s"
+        yield f"sigma[{params}]", ready(lambda: sigma(p, n, N)), g, "groups/s"
+
+        yield f"plot_poll[{params}]", ready(drawn(lambda: plotting.plot_poll(population, colors, voters=n, without_replacement=not replace))), 1, "plots/s"
+        yield f"plot_polls[{params}]", ready(drawn(lambda: plotting.plot_polls(population, colors, voters=n, polls=100, without_replacement=not replace))), 1, "plots/s"
+        yield f"plot_polls.density[{params}]", ready(drawn(lambda: plotting.plot_polls(population, colors, voters=n, polls=100, without_replacement=not replace, density=True, workers=1))), 1, "plots/s"
+
+        # a frame of each animation halfway through
+        yield f"plot_single_poll.frame[{params}]", lambda: frame(
+            plotting.single_poll_figure, (population, colors, n, tallies, 0.95),
+            Accumulator(population, 0.95, not replace, population.weight_array * (n // 2) // population.size),
+        ), 1, "frames/s"
+        yield f"plot_multiple_polls.frame[{params}]", lambda: frame(
+            plotting.multiple_polls_figure, (population, colors, n, poll_batch(population, n, 100, not replace), 0.95, not replace),
+            50,
+        ), 1, "frames/s"
+
+    # the population plot does not depend on the voters or replacement
+    for g in groups:
+        population = population_of(g, 10 * max(*voters, g))
+        colors = colors_of(population)
+        yield f"plot_population[groups={g}]", ready(drawn(lambda: plotting.plot_population(population, colors))), 1, "plots/s"
+
+
+
+def ready(function):
+    return lambda: function
+
+
+def drawn(plot):
+    # plot, render and close the figure
+    def run():
+        plot()
+        plt.gcf().canvas.draw()
+        plt.close("all")
+    return run
+
+
+def frame(build, args, state):
+    # render one frame of an animation, on a figure built beforehand
+    fig, draw = build(*args)
+    for artist in fig.findobj(lambda artist: artist.get_animated()):
+        artist.set_animated(False)
+
+    def run():
+        draw(state)
+        fig.canvas.draw()
+    return run
+
+
+
+def run(groups=GROUPS, voters=VOTERS, replacement=(False, True), keyword="", min_time=0.2):
+    """
+    Return the results of the benchmarks of the grid whose names contain {keyword}
+    """
+    results = {}
+
+    with warnings.catch_warnings():
+        # plt.show() on Agg
+        warnings.simplefilter("ignore", UserWarning)
+
+        for name, prepare, work, unit in cases(groups, voters, replacement):
+            if keyword not in name: continue
+
+            seconds = timed(prepare(), min_time)
+            results[name] = dict(seconds=seconds, rate=work / seconds, unit=unit)
+            plt.close("all")
+
+    return results
+
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Return the benchmarks present in both runs that are more than {threshold}
+    slower than in {baseline}, as {name: (baseline seconds, seconds)}
+    """
+    return {
+        name : (baseline[name]["seconds"], result["seconds"])
+        for name, result in results.items()
+        if name in baseline and result["seconds"] > (1 + threshold) * baseline[name]["seconds"]
+    }
+
+
+
+if __name__ == "__main__":
+    import sys
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-g", "--groups", default=None, type=int, nargs="*", help="Numbers of groups")
+    parser.add_argument("-v", "--voters", default=None, type=int, nargs="*", help="Numbers of voters")
+    parser.add_argument("-r", "--replace", default="both", choices=["no", "yes", "both"], help="Sample with replacement")
+    parser.add_argument("-k", "--keyword", default="", help="Only run the benchmarks whose name contains this")
+    parser.add_argument("-q", "--quick", action="store_true", help="Run the small part of the grid")
+    parser.add_argument("-m", "--min-time", default=0.2, type=float, help="Seconds to repeat each benchmark for")
+    parser.add_argument("-o", "--output", default=None, help="Write the results to this json file")
+    parser.add_argument("-b", "--baseline", default=None, help="Compare against the results in this json file")
+    parser.add_argument("-t", "--threshold", default=0.25, type=float, help="Slowdown relative to the baseline that counts as a regression")
+
+    options = parser.parse_args()
+
+    groups = options.groups or (QUICK_GROUPS if options.quick else GROUPS)
+    voters = options.voters or (QUICK_VOTERS if options.quick else VOTERS)
+    replacement = {"no": (False,), "yes": (True,), "both": (False, True)}[options.replace]
+
+    results = run(groups, voters, replacement, options.keyword, options.min_time)
+
+    for name, result in results.items():
+        print(f"{name:70} {result['seconds']*1e3:12.3f} ms {result['rate']:16.4g} {result['unit']}")
+
+    if options.output:
+        meta = dict(python=platform.python_version(), numpy=np.__version__, matplotlib=matplotlib.__version__, machine=platform.machine())
+        with open(options.output, "w") as f:
+            json.dump(dict(meta=meta, results=results), f, indent=1)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, options.threshold)
+        for name, (before, after) in regressions.items():
+            print(f"regression: {name} {before*1e3:.3f} ms -> {after*1e3:.3f} ms ({after/before - 1:+.0%})", file=sys.stderr)
+
+        sys.exit(1 if regressions else 0)
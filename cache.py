@@ -0,0 +1,117 @@
+"""
+On-disk cache of seeded simulations
+
+Simulations are keyed by a hash of the population, the sampling parameters,
+polling.ENGINE_VERSION and the seed, and stored as result files. The least
+recently used entries are evicted when the cache grows past its byte budget.
+
+    cache = SimulationCache("~/.cache/polling", budget=1 << 30)
+    counts = cache.poll_batch(parties, 5000, 600, seed=0)
+    cache.hits, cache.misses
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+import results
+from polling import Tally, ENGINE_VERSION
+from montecarlo import run_polls
+
+
+
+class SimulationCache:
+    def __init__(self, directory, budget=1 << 30):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+
+
+    def key(self, kind, population, **params):
+        """
+        Return the hash identifying a simulation of {kind} over {population} with {params}
+        """
+        description = dict(
+            kind       = kind,
+            engine     = ENGINE_VERSION,
+            population = list(zip(population.groups, population.weight_array.tolist())),
+            params     = params,
+        )
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+    def _cached(self, kind, population, simulate, **params):
+        path = self.directory / f"{self.key(kind, population, **params)}.bin"
+
+        try:
+            counts, _meta = results.load(path)
+        except FileNotFoundError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            os.utime(path)  # mark as recently used
+            return counts
+
+        counts = simulate()
+
+        # write under a temporary name, so readers never see a partial entry
+        temporary = path.with_suffix(f".{os.getpid()}.tmp")
+        results.save(temporary, counts, population, kind=kind, **params)
+        os.replace(temporary, path)
+
+        self.evict()
+        return counts
+
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its budget
+        """
+        entries = sorted(self.directory.glob("*.bin"), key=lambda path: path.stat().st_mtime)
+        size = sum(path.stat().st_size for path in entries)
+
+        for path in entries:
+            if size <= self.budget: break
+            size -= path.stat().st_size
+            path.unlink(missing_ok=True)
+
+
+    @property
+    def size(self):
+        return sum(path.stat().st_size for path in self.directory.glob("*.bin"))
+
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, bytes=self.size, budget=self.budget)
+
+
+    def poll_batch(self, population, size, polls, without_replacement=True, seed=0, workers=1):
+        """
+        Return run_polls(...) of the arguments, simulated only on a cache miss
+        """
+        simulate = lambda: run_polls(population, size, polls, without_replacement, seed=seed, workers=workers)
+        return self._cached("polls", population, simulate, voters=size, polls=polls, without_replacement=without_replacement, seed=seed)
+
+
+    def poll(self, population, size, without_replacement=True, seed=0):
+        """
+        Return the counts of a single poll, as poll(..., codes=True)
+        """
+        return self.poll_batch(population, size, 1, without_replacement, seed)[0]
+
+
+    def tallies(self, population, N, n, without_replacement=True, seed=0):
+        """
+        Return the tallies of Tally(..., codes=True) as a (tallies, groups) array
+        """
+        def simulate():
+            tallies = Tally(population, N, n, without_replacement, codes=True, rng=np.random.default_rng(seed))
+            return np.array(list(tallies), dtype=np.int64).reshape(-1, len(population))
+
+        return self._cached("tallies", population, simulate, voters=N, tallies=n, without_replacement=without_replacement, seed=seed)
@@ -0,0 +1,51 @@
+"""
+The binary container of result and electorate files
+
+A file is an 8 byte magic, the length of a json header as 8 little endian
+bytes, the header, and from the next 64 byte boundary the memory-mapped data.
+
+    with open(path, "wb") as f:
+        data = write_header(f, b"POLLRSLT", header)
+
+    header, data = read_header(path, b"POLLRSLT", "a result file")
+    np.memmap(path, ..., offset=data)
+"""
+
+import json
+
+
+ALIGN = 64
+
+
+
+def aligned(offset):
+    # the next 64 byte boundary at or after {offset}
+    return -(-offset // ALIGN) * ALIGN
+
+
+
+def write_header(f, magic, header):
+    """
+    Write {magic} and the json {header} to the file {f}, and return the offset of the data
+    """
+    encoded = json.dumps(header).encode()
+
+    f.write(magic)
+    f.write(len(encoded).to_bytes(8, "little"))
+    f.write(encoded)
+
+    return aligned(len(magic) + 8 + len(encoded))
+
+
+
+def read_header(path, magic, description):
+    """
+    Return the json header of the file {path} and the offset of its data.
+    A file not starting with {magic} raises ValueError: "{path} is not {description}"
+    """
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic: raise ValueError(f"{path} is not {description}")
+        length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(length))
+
+    return header, aligned(len(magic) + 8 + length)
@@ -0,0 +1,33 @@
+"""
+Election results used as simulation populations
+"""
+
+from polling import Population
+
+
+
+# Stortingsvalgresultat 2017
+parties = Population({
+    "R"   :  70_522,
+    "SV"  : 175_222,
+    "AP"  : 800_947,
+    "SP"  : 302_017,
+    "MDG" :  94_788,
+    "KRF" : 122_797,
+    "V"   : 127_910,
+    "H"   : 732_895,
+    "FRP" : 444_681,
+})
+
+# colours from https://www.nrk.no/valg/2017/resultat/
+party_color = {
+    "R"   : "#990014",
+    "SV"  : "#d94abf",
+    "AP"  : "#e51c30",
+    "SP"  : "#a5cd39",
+    "MDG" : "#3d8704",
+    "KRF" : "#f0b618",
+    "V"   : "#24b38c",
+    "H"   : "#00b9f2",
+    "FRP" : "#005799",
+}
@@ -0,0 +1,161 @@
+"""
+Voter-level populations stored as memory-mapped integer columns
+
+The file is an 8 byte magic, the length of a json header as 8 little endian
+bytes, the header, and then one fixed-width integer column per attribute,
+each starting on a 64 byte boundary.
+
+    Electorate.write("voters.bin", groups=("R", "SV", ...), columns={
+        "party"   : party_codes,
+        "region"  : region_codes,
+        "age"     : age_bands,
+        "turnout" : turnout_propensity,
+    })
+
+    electorate = Electorate("voters.bin")
+    poll(electorate, 1000)                 # aggregate polls, as for Population
+    electorate.poll(1000, by="region")     # voter-level polls
+"""
+
+import numpy as np
+
+from polling import Population, _rng
+from container import write_header, read_header, aligned
+
+
+MAGIC = b"POLLVOTR"
+CHUNK = 1 << 22
+
+
+
+class Electorate:
+    """
+    A population of individual voters in a memory-mapped columnar file.
+    Opening it only reads the header; the group weights are counted from
+    the group column on first use, a chunk at a time.
+
+    The aggregate interface (groups, weights, size, p, ...) is that of
+    Population, so the polling functions accept an Electorate as well.
+    """
+    def __init__(self, path):
+        header, data = read_header(path, MAGIC, "an electorate file")
+
+        self.path = path
+        self.groups = tuple(header["groups"])
+        self.group_column = header["group_column"]
+        self.size = header["rows"]
+        self.group_index = {group : i for i, group in enumerate(self.groups)}
+
+        self.columns = {
+            name : np.memmap(path, dtype=column["dtype"], mode="r", offset=data + column["offset"], shape=(self.size,))
+            for name, column in header["columns"].items()
+        }
+
+        self._population = None
+
+
+    @staticmethod
+    def write(path, groups, columns, group_column="party"):
+        """
+        Write the integer arrays {columns}, one value per voter, as an electorate file.
+        {group_column} holds the group code (index into {groups}) of each voter.
+        """
+        columns = {name : np.asarray(values) for name, values in columns.items()}
+        rows, = {len(values) for values in columns.values()}
+
+        header = dict(groups=list(groups), group_column=group_column, rows=rows, columns={})
+
+        # column offsets are relative to the first 64 byte boundary after the header
+        offset = 0
+        for name, values in columns.items():
+            header["columns"][name] = dict(dtype=values.dtype.str, offset=offset)
+            offset = aligned(offset + values.nbytes)
+
+        with open(path, "wb") as f:
+            data = write_header(f, MAGIC, header)
+
+            for name, values in columns.items():
+                f.seek(data + header["columns"][name]["offset"])
+                f.write(np.ascontiguousarray(values).tobytes())
+
+
+    def __reduce__(self):
+        # reopen the file rather than pickling the mapped columns
+        return Electorate, (self.path,)
+
+
+    @property
+    def population(self):
+        """
+        The aggregate Population of the electorate, counted on first use
+        """
+        if self._population is None:
+            column = self.columns[self.group_column]
+            weights = np.zeros(len(self.groups), dtype=np.int64)
+
+            for start in range(0, self.size, CHUNK):
+                weights += np.bincount(column[start:start + CHUNK], minlength=len(self.groups))
+
+            self._population = Population(dict(zip(self.groups, weights.tolist())))
+        return self._population
+
+
+    def __getattr__(self, name):
+        # weights, p, probabilities, alias, ...
+        if name.startswith("__") or name == "_population": raise AttributeError(name)
+        return getattr(self.population, name)
+
+
+    def __getitem__(self, group):
+        return self.population[group]
+
+
+    def __contains__(self, group):
+        return group in self.group_index
+
+
+    def __len__(self):
+        return len(self.groups)
+
+
+    def __iter__(self):
+        return iter(self.groups)
+
+
+    def sample(self, size, without_replacement=True, rng=None):
+        """
+        Return the sorted row indices of {size} random voters. Without replacement
+        the rows are drawn by a partial shuffle of the row indices.
+        """
+        assert size <= self.size
+        rng = _rng(rng)
+
+        if without_replacement:
+            rows = rng.choice(self.size, size, replace=False)
+        else:
+            rows = rng.integers(self.size, size=size)
+        rows.sort()
+        return rows
+
+
+    def rows(self, rows):
+        """
+        Return the columns of the voters at row indices {rows}
+        """
+        return {name : column[rows] for name, column in self.columns.items()}
+
+
+    def poll(self, size, without_replacement=True, by=None, rng=None):
+        """
+        Return the number of sampled voters in each group, ordered by group_index,
+        or, if {by} names a column, a (values of {by}, groups) table of counts
+        """
+        rows = self.sample(size, without_replacement, rng)
+        votes = self.columns[self.group_column][rows].astype(np.intp)
+
+        if by is None:
+            return np.bincount(votes, minlength=len(self.groups))
+
+        levels = self.columns[by][rows].astype(np.intp)
+        table = np.bincount(levels * len(self.groups) + votes, minlength=(levels.max(initial=-1) + 1) * len(self.groups))
+        return table.reshape(-1, len(self.groups))
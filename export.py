@@ -0,0 +1,130 @@
+"""
+Parallel offline export of the animations
+
+Once the simulation is done every frame is independent of the others, so
+the frames are rendered in worker processes, each holding its own copy of
+the figure on the Agg backend, and streamed in order as raw RGBA into a
+single encoder:
+
+    export_animation("polls.webm", multiple_polls_figure, figure_args, range(1, polls + 1))
+
+{build}(*{args}) must return (fig, draw), where draw(state) sets every
+artist of the figure for one frame; {states} holds the state of each frame.
+"""
+
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+
+_figure = None
+_states = None
+
+
+
+def _agg_figure(build, args):
+    # render through an Agg canvas, whatever the backend of the process
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig, draw = build(*args)
+    plt.close(fig)
+    FigureCanvasAgg(fig)
+
+    # the figures are built for blitting, and a full draw skips animated artists
+    for artist in fig.findobj(lambda artist: artist.get_animated()):
+        artist.set_animated(False)
+
+    return fig, draw
+
+
+def _init(build, args, states):
+    global _figure, _states
+
+    _figure = _agg_figure(build, args)
+    _states = states
+
+
+def _worker_init(build, args, states):
+    import matplotlib
+    matplotlib.use("Agg")
+    _init(build, args, states)
+
+
+def _render(frames):
+    # the frames of a chunk share one process, and its figure
+    fig, draw = _figure
+    rendered = []
+
+    for frame in frames:
+        draw(_states[frame])
+        fig.canvas.draw()
+        rendered.append(bytes(fig.canvas.buffer_rgba()))
+
+    return b"".join(rendered)
+
+
+
+def frame_size(build, args):
+    """
+    Return the (width, height) in pixels of the frames of the figure {build}(*{args})
+    """
+    fig, _draw = _agg_figure(build, args)
+    fig.canvas.draw()
+    return fig.canvas.get_width_height()
+
+
+
+def export_frames(build, args, states, out, workers=None, chunk_size=8):
+    """
+    Render a frame for each of {states} over {workers} processes, and
+    write them in order to the binary stream {out} as raw RGBA
+    """
+    workers = workers or cpu_count()
+    chunks = [range(start, min(start + chunk_size, len(states))) for start in range(0, len(states), chunk_size)]
+
+    if workers == 1:
+        _init(build, args, states)
+        for chunk in chunks:
+            out.write(_render(chunk))
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_worker_init, initargs=(build, args, states)) as pool:
+        # keep a few chunks per worker in flight, and write them in order
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_render, chunk))
+            if len(pending) > 2 * workers:
+                out.write(pending.popleft().result())
+        while pending:
+            out.write(pending.popleft().result())
+
+
+
+def export_animation(path, build, args, states, fps=20, workers=None, codec="libvpx-vp9"):
+    """
+    Render the animation to the video file {path}, encoding the frames
+    with ffmpeg as they are rendered
+    """
+    width, height = frame_size(build, args)
+
+    encoder = subprocess.Popen(
+        ["ffmpeg", "-y", "-loglevel", "error",
+         "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+         "-c:v", codec, "-pix_fmt", "yuva420p", str(path)],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    broken = False
+    try:
+        export_frames(build, args, states, encoder.stdin, workers)
+    except BrokenPipeError:
+        # ffmpeg exited early, and its stderr says why
+        broken = True
+    finally:
+        # closes stdin (without raising again on a broken pipe) and waits for ffmpeg
+        _, errors = encoder.communicate()
+
+    if broken or encoder.returncode:
+        raise RuntimeError(f"ffmpeg failed to encode {path} (exit code {encoder.returncode}): {errors.decode(errors='replace').strip()}")
@@ -0,0 +1,193 @@
+"""
+Opt-in timing of the hot paths
+
+Nothing is instrumented until enable() is called, e.g. by the --instrument
+flag or the POLLING_INSTRUMENT environment variable of __main__. It replaces
+the functions of the stages below in every loaded module that refers to them
+with timed wrappers, and reports the call counts, cumulative time and
+throughput of each stage at exit:
+
+    python . -P polls -A --instrument              # print the summary to stderr
+    POLLING_INSTRUMENT=stages.json python . -P poll  # dump it as json
+
+Generators are timed over every item they yield, and the figure builders
+of the animations count each call of their draw function as a frame.
+"""
+
+import atexit
+import json
+import sys
+from functools import wraps
+from inspect import signature
+from time import perf_counter
+
+import numpy as np
+
+
+enabled = False
+stages = {}
+
+
+
+class Stage:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.calls = 0
+        self.seconds = 0.0
+        self.work = 0
+
+    def add(self, seconds, work=0):
+        self.seconds += seconds
+        self.work += work
+
+    def summary(self):
+        rate = self.work / self.seconds if self.seconds else 0.0
+        return dict(calls=self.calls, seconds=self.seconds, work=self.work, unit=self.unit, rate=rate)
+
+
+def stage(name, unit="calls"):
+    if name not in stages: stages[name] = Stage(name, unit)
+    return stages[name]
+
+
+
+def argument(name):
+    # the work of a call is the value of one of its arguments
+    return lambda arguments, result: arguments[name]
+
+
+def counted(item):
+    # the number of votes in a tally, as a Counter or array
+    return sum(item.values()) if isinstance(item, dict) else int(np.sum(item))
+
+
+def timed(function, name, unit="calls", work=None):
+    """
+    Return {function} recording its calls, time and work
+    (work(arguments, result), or one unit per call) as stage {name}
+    """
+    record = stage(name, unit)
+    bind = signature(function).bind
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        seconds = perf_counter() - start
+
+        record.calls += 1
+        if work is None:
+            record.add(seconds, 1)
+        else:
+            bound = bind(*args, **kwargs)
+            bound.apply_defaults()
+            record.add(seconds, work(bound.arguments, result))
+        return result
+
+    return wrapper
+
+
+def timed_generator(function, name, unit, work=lambda item: 1):
+    """
+    Return the generator function {function} recording the time spent
+    producing its items, and their work(item), as stage {name}
+    """
+    record = stage(name, unit)
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        record.calls += 1
+        items = function(*args, **kwargs)
+
+        while True:
+            start = perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                record.add(perf_counter() - start)
+                return
+            record.add(perf_counter() - start, work(item))
+            yield item
+
+    return wrapper
+
+
+def timed_figure(function, name):
+    """
+    Return the figure builder {function}, whose draw functions record each frame as stage {name}
+    """
+    frames = timed(lambda draw, state: draw(state), name, "frames")
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        fig, draw = function(*args, **kwargs)
+        return fig, lambda state: frames(draw, state)
+
+    return wrapper
+
+
+
+def _targets():
+    import polling, montecarlo, plotting
+
+    yield polling, "votes", lambda f: timed_generator(f, "votes", "ballots")
+    yield polling, "votes_chunks", lambda f: timed_generator(f, "votes_chunks", "ballots", len)
+    yield polling, "ballots", lambda f: timed(f, "ballots", "ballots", argument("size"))
+    yield polling, "poll", lambda f: timed(f, "poll", "ballots", argument("size"))
+    yield polling, "poll_batch", lambda f: timed(f, "poll_batch", "polls", argument("polls"))
+    yield polling, "Tally", lambda f: timed_generator(f, "Tally", "ballots", counted)
+    yield polling, "count", lambda f: timed(f, "count", "ballots", lambda arguments, result: len(arguments["codes"]))
+    yield polling.Population, "counter", lambda f: timed(f, "Population.counter", "groups", lambda arguments, result: len(result))
+    yield polling, "sigma", lambda f: timed(f, "sigma", "values", lambda arguments, result: np.size(result))
+    yield polling, "error", lambda f: timed(f, "error", "values", lambda arguments, result: np.size(result))
+    yield montecarlo, "run_polls", lambda f: timed(f, "run_polls", "polls", argument("polls"))
+
+    for name in ("plot_population", "plot_poll", "plot_polls", "plot_single_poll", "plot_multiple_polls"):
+        yield plotting, name, lambda f, name=name: timed(f, name, "plots")
+    yield plotting, "single_poll_figure", lambda f: timed_figure(f, "plot_single_poll.frame")
+    yield plotting, "multiple_polls_figure", lambda f: timed_figure(f, "plot_multiple_polls.frame")
+
+
+
+def enable(output="-"):
+    """
+    Instrument the stages, and report them at exit to stderr, or
+    as json to {output} if it names a .json file
+    """
+    global enabled
+    if enabled: return
+    enabled = True
+
+    replaced = {}
+    for owner, name, wrap in _targets():
+        function = getattr(owner, name)
+        replaced[id(function)] = wrapper = wrap(function)
+        if isinstance(owner, type): setattr(owner, name, wrapper)
+
+    # rebind every reference, including those imported with "from polling import ..."
+    for module in list(sys.modules.values()):
+        namespace = getattr(module, "__dict__", None)
+        if not isinstance(namespace, dict): continue
+
+        for attribute, value in list(namespace.items()):
+            if callable(value) and id(value) in replaced:
+                namespace[attribute] = replaced[id(value)]
+
+    atexit.register(report, output)
+
+
+
+def summary():
+    return {name : record.summary() for name, record in stages.items() if record.calls}
+
+
+def report(output="-"):
+    if output and str(output).endswith(".json"):
+        with open(output, "w") as f:
+            json.dump(summary(), f, indent=1)
+        return
+
+    print(f"{'stage':28} {'calls':>10} {'seconds':>12} {'throughput':>24}", file=sys.stderr)
+    for name, record in summary().items():
+        print(f"{name:28} {record['calls']:10} {record['seconds']:12.4f} {record['rate']:16,.0f} {record['unit']}/s", file=sys.stderr)
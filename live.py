@@ -0,0 +1,219 @@
+"""
+Live counts of district results
+
+Updates are json lines of the counts reported by a district so far,
+
+    {"district": "Oslo", "counts": {"AP": 1203, "H": 1180, ...}}
+
+and replace the earlier report of that district. They are read from a
+socket or a file, which is followed as it grows, by an asyncio loop in a
+background thread, so the animation reading the running count never waits:
+
+    live = LiveCount(parties)
+    start("localhost:8765", live)       # or start("results.jsonl", live)
+    running, districts = live.snapshot()
+    running.counts, running.proportions, running.margins
+
+A stand-in feed replays a Tally run, a district per tally:
+
+    python live.py -p 8765 -v 100000 -t 500
+"""
+
+import asyncio
+import json
+import sys
+from threading import Thread, Lock
+
+import numpy as np
+
+from polling import Tally, Accumulator, _rng
+
+
+
+class LiveCount:
+    """
+    The running estimate (an Accumulator) of the latest report of every
+    district, updated in O(groups) per report, and the error that stopped
+    the ingestion, if one did
+    """
+    def __init__(self, population, alpha=0.95, without_replacement=True):
+        self.population = population
+        self.districts = {}
+        self.running = Accumulator(population, alpha, without_replacement)
+        self.updates = 0
+        self.error = None
+
+        self._lock = Lock()
+
+
+    def update(self, district, counts):
+        """
+        Replace the counts of {district}, a {group: count} mapping
+        """
+        reported = np.zeros(len(self.population), dtype=np.int64)
+        for group, count in counts.items():
+            reported[self.population.group_index[group]] = count
+
+        with self._lock:
+            previous = self.districts.get(district)
+            self.running.add(reported if previous is None else reported - previous)
+            self.districts[district] = reported
+            self.updates += 1
+
+
+    def snapshot(self):
+        """
+        Return a copy of the running estimate, and the number of districts reported
+        """
+        with self._lock:
+            return self.running.copy(), len(self.districts)
+
+
+
+def parse(line):
+    update = json.loads(line)
+    return update["district"], update["counts"]
+
+
+async def ingest(lines, live):
+    # a bad update is skipped, rather than ending the ingestion with it
+    async for line in lines:
+        if not line.strip(): continue
+        try:
+            live.update(*parse(line))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"skipping update {line.strip()[:80]!r}: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+
+async def socket_lines(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while (line := await reader.readline()):
+            yield line
+    finally:
+        writer.close()
+
+
+async def file_lines(path, interval=0.1, follow=True):
+    """
+    Yield the lines of {path}, and with follow=True the lines appended to it
+    later, checking for more every {interval} seconds
+    """
+    with open(path) as f:
+        partial = ""
+        while True:
+            line = f.readline()
+
+            if line.endswith("\n"):
+                yield partial + line
+                partial = ""
+            elif line:
+                # the writer is midway through a line
+                partial += line
+            elif follow:
+                await asyncio.sleep(interval)
+            else:
+                if partial: yield partial
+                return
+
+
+def lines_of(source, follow=True):
+    # host:port (or tcp://host:port) for a socket, anything else is a file
+    address = source.removeprefix("tcp://")
+    host, _, port = address.rpartition(":")
+
+    if source.startswith("tcp://") or (host and port.isdigit()):
+        return socket_lines(host, int(port))
+    return file_lines(source, follow=follow)
+
+
+
+def start(source, live, follow=True):
+    """
+    Ingest the updates of {source} into {live} in a background thread, and return the thread.
+    If the source fails, e.g. a refused or dropped connection, the thread
+    ends with the error in live.error.
+    """
+    thread = Thread(target=_run, args=(source, live, follow), daemon=True)
+    thread.start()
+    return thread
+
+
+def _run(source, live, follow):
+    try:
+        asyncio.run(ingest(lines_of(source, follow), live))
+    except Exception as error:
+        live.error = error
+        print(f"stopped ingesting {source}: {type(error).__name__}: {error}", file=sys.stderr)
+
+
+
+def updates(population, N, n, steps=2, without_replacement=True, rng=None):
+    """
+    Yield update lines replaying Tally(population, N, n), a district per tally.
+    Every district reports {steps} times with growing counts, the districts
+    interleaved at random.
+    """
+    rng = _rng(rng)
+    tallies = list(Tally(population, N, n, without_replacement, codes=True, rng=rng))
+
+    # the k-th report of a district reports k/steps of its votes
+    order = np.repeat(np.arange(len(tallies)), steps)
+    rng.shuffle(order)
+    reported = np.zeros(len(tallies), dtype=np.int64)
+
+    for district in order.tolist():
+        reported[district] += 1
+        counts = tallies[district] * reported[district] // steps
+        yield json.dumps(dict(district=f"district {district}", counts=dict(zip(population.groups, counts.tolist())))) + "\n"
+
+
+
+async def serve(population, N, n, host="localhost", port=8765, burst=10, interval=0.05, steps=2, without_replacement=True):
+    """
+    Serve a replay of Tally(population, N, n) to every connection,
+    in bursts of {burst} updates every {interval} seconds
+    """
+    async def replay(reader, writer):
+        try:
+            for i, line in enumerate(updates(population, N, n, steps, without_replacement), 1):
+                if writer.is_closing(): break  # the client left
+                writer.write(line.encode())
+                if i % burst == 0:
+                    await writer.drain()
+                    await asyncio.sleep(interval)
+
+            await writer.drain()
+        except ConnectionError:
+            pass  # the client left
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(replay, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    from elections import parties
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-H", "--host", default="localhost", help="Address to serve the feed on")
+    parser.add_argument("-p", "--port", default=8765, type=int, help="Port to serve the feed on")
+    parser.add_argument("-v", "--voters", default=100_000, type=int, help="Number of votes counted")
+    parser.add_argument("-t", "--tallies", default=500, type=int, help="Number of districts")
+    parser.add_argument("-b", "--burst", default=10, type=int, help="Updates sent at a time")
+    parser.add_argument("-i", "--interval", default=0.05, type=float, help="Seconds between bursts")
+    parser.add_argument("-s", "--steps", default=2, type=int, help="Reports per district")
+    parser.add_argument("-r", "--replace", action="store_true", help="Sample with replacement")
+
+    options = parser.parse_args()
+
+    asyncio.run(serve(
+        parties, options.voters, options.tallies, options.host, options.port,
+        options.burst, options.interval, options.steps, not options.replace,
+    ))
@@ -0,0 +1,58 @@
+"""
+Run large batches of polls over several processes
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from polling import poll_batch
+
+
+
+def block_rng(seed, block):
+    """
+    Return the independent random stream of block {block} of a run seeded with {seed}
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+
+
+
+def _poll_block(population, size, polls, without_replacement, seed, block):
+    return poll_batch(population, size, polls, without_replacement, rng=block_rng(seed, block))
+
+
+
+def poll_blocks(population, size, polls, without_replacement=True, seed=0, workers=None, block_size=10_000):
+    """
+    Yield the results of run_polls(...) a block of {block_size} polls at a time, in order
+    """
+    blocks = [min(block_size, polls - start) for start in range(0, polls, block_size)]
+    args = (repeat(population), repeat(size), blocks, repeat(without_replacement), repeat(seed), range(len(blocks)))
+
+    if workers == 1:
+        yield from map(_poll_block, *args)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            yield from pool.map(_poll_block, *args)
+
+
+
+def run_polls(population, size, polls, without_replacement=True, seed=0, workers=None, block_size=10_000, out=None):
+    """
+    Return the results of {polls} polls as poll_batch does, simulated
+    in blocks of {block_size} polls spread over {workers} processes.
+
+    Every block draws from its own stream spawned from {seed}, so the
+    results depend on the seed and block size, but not on the number
+    of workers (workers=1 runs in this process).
+
+    The results are written into {out} if given, e.g. a results.create() memmap.
+    """
+    results = np.empty((polls, len(population)), dtype=np.int64) if out is None else out
+
+    for block, chunk in enumerate(poll_blocks(population, size, polls, without_replacement, seed, workers, block_size)):
+        results[block * block_size : block * block_size + len(chunk)] = chunk
+
+    return results
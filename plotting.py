@@ -1,7 +1,12 @@
-from polling import votes, poll, Tally, error
-from collections import Counter
-from math import log, inf
+from polling import Tally, Accumulator, adaptive_poll, error
+from montecarlo import run_polls, poll_blocks
+from results import save as save_results
+from export import export_animation
+from live import LiveCount, start
+from itertools import count
+from math import inf
 from color import Color
+import numpy as np
 
 def create_folder_if_not_exists(name):
     from pathlib import Path
@@ -9,11 +14,56 @@ def create_folder_if_not_exists(name):
     folder.mkdir(parents=True, exist_ok=True)
     return folder
 
+def simulate_polls(population, voters, polls, without_replacement=True, workers=None, seed=0, cache=None):
+    # always the seeded block streams of run_polls, so a seed gives the same polls for any number of workers
+    if cache is not None:
+        return cache.poll_batch(population, voters, polls, without_replacement=without_replacement, seed=seed, workers=workers or 1)
+    return run_polls(population, voters, polls, without_replacement=without_replacement, seed=seed, workers=workers or 1)
+
+def poll_results(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache):
+    # simulate (and store) the polls, unless rendering stored counts
+    if counts is None:
+        counts = simulate_polls(population, voters, polls, without_replacement, workers, seed, cache)
+
+        if store:
+            save_results(store, counts, population, kind="polls", voters=voters, polls=polls, alpha=alpha, without_replacement=without_replacement, seed=seed)
+    return counts
+
+def poll_histograms(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache, width=1, limit=None, block_size=10_000):
+    """
+    Return how many polls got each result, as a (groups, bins) array with bins
+    of {width} results from 0 to {limit} (voters by default), the last bin also
+    counting any higher results. The polls are simulated and counted a block at a time.
+    """
+    if counts is None and (store or cache):
+        counts = poll_results(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache)
+
+    if counts is None:
+        blocks = poll_blocks(population, voters, polls, without_replacement, seed=seed, workers=workers or 1, block_size=block_size)
+    else:
+        blocks = (counts[start:start + block_size] for start in range(0, len(counts), block_size))
+
+    limit = voters if limit is None else min(limit, voters)
+    bins = limit // width + 1
+
+    # group i counts its results in bins i*bins ...
+    groups = len(population)
+    offsets = np.arange(groups) * bins
+    histograms = np.zeros(groups * bins, dtype=np.int64)
+
+    for block in blocks:
+        histograms += np.bincount((np.minimum(block, limit) // width + offsets).ravel(), minlength=len(histograms))
+
+    return histograms.reshape(groups, bins)
+
 # ===
 
 from matplotlib import pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib import gridspec
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.ticker import PercentFormatter
 
 def plot_population(population, group_color, save=False):
     largest_group = max(population, key=lambda g: population[g])
@@ -56,8 +106,8 @@ def plot_population(population, group_color, save=False):
 # ===
 
 
-def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacement=True, save=False):
-    if voters is None: voters = sum(population.weights)
+def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacement=True, seed=0, cache=None, margin=None, save=False):
+    if voters is None: voters = population.size
     largest_group = max(population, key=lambda g: population[g])
 
     size_limit = population.size if without_replacement else inf
@@ -77,15 +127,18 @@ def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacem
     # bars
 
     indexes = list(population.group_index.values())
-    results = poll(population, voters, without_replacement=without_replacement)
-    heights = [results[group] for group in population]
+    if margin is not None:
+        # ask at most {voters} voters, stopping once every margin is small enough
+        heights, voters = adaptive_poll(population, margin, alpha, budget=voters, without_replacement=without_replacement, codes=True, rng=np.random.default_rng(seed))
+    elif cache is None:
+        heights = run_polls(population, voters, 1, without_replacement=without_replacement, seed=seed, workers=1)[0]
+    else:
+        heights = cache.poll(population, voters, without_replacement=without_replacement, seed=seed)
 
     bars = ax.bar(indexes, heights, color=group_color.values())
 
-    errors = [
-        voters * error(population.p(group), voters, N=size_limit, alpha=0.95)
-        for group in population
-    ]
+    p = population.probabilities
+    errors = voters * error(p, voters, N=size_limit, alpha=0.95)
     for i, color in enumerate(group_color.values()):
         ax.errorbar(
             i, heights[i], yerr=errors[i],
@@ -93,7 +146,7 @@ def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacem
         )
 
     true_p = ax.hlines(
-        [voters * population.p(group) for group in population],
+        voters * population.probabilities,
         [i-0.4 for i in indexes],
         [i+0.4 for i in indexes],
         colors=[Color(c).darken(10) for c in group_color.values()]
@@ -106,7 +159,10 @@ def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacem
     ax.set_xticks(range(len(population)))
     ax.set_xticklabels(population.groups)
 
-    ax.set_title(f"The poll distribution after asking {voters} voters, {alpha = }")
+    if margin is None:
+        ax.set_title(f"The poll distribution after asking {voters} voters, {alpha = }")
+    else:
+        ax.set_title(f"The poll distribution after asking {voters} voters for a {margin:.1%} margin, {alpha = }")
 
     if save:
         folder = create_folder_if_not_exists("figures")
@@ -117,14 +173,14 @@ def plot_poll(population, group_color, voters=None, alpha=0.95, without_replacem
 # ===
 
 
-def plot_single_poll(population, group_color, voters=None, tallies=500, alpha=0.95, without_replacement=True, save=False):
-    if voters is None: voters = sum(population.weights) #100_000
-
+def single_poll_figure(population, group_color, voters, tallies, alpha=0.95, title=None):
+    """
+    Build the vote counting figure, and return it with draw(running),
+    which shows the running estimate of the count, an Accumulator,
+    and returns the artists it changed
+    """
     largest_group = max(population, key=lambda g: population[g])
 
-    size_limit = population.size if without_replacement else inf
-
-
     fig = plt.figure()
     gs = gridspec.GridSpec(2, 1, height_ratios=[1, 29], hspace=0)
 
@@ -145,117 +201,148 @@ def plot_single_poll(population, group_color, voters=None, tallies=500, alpha=0.
 
     indexes = list(population.group_index.values())
     heights = [0]*len(population)
-    tally = Tally(population, voters, tallies, without_replacement=without_replacement)
+    p = population.probabilities
+
+    # the bars show vote shares, so the axes stay fixed while the votes are counted
+
+    bars = ax.bar(indexes, heights, color=group_color.values(), animated=True)
+    error_color = [Color(c).darken(20) for c in group_color.values()]
+    errorbars = ax.vlines(indexes, heights, heights, colors=error_color, linewidth=1, animated=True)
+    caps = ax.scatter(indexes * 2, heights * 2, marker="_", s=30**2, linewidths=1, c=error_color * 2, animated=True)
 
-    bars = ax.bar(indexes, heights, color=group_color.values())
-    errors = [
-        ax.errorbar(i, heights[i], yerr=0, capsize=15, capthick=1, fmt='none', color=Color(color).darken(20)) for i, color in enumerate(group_color.values())
-    ]
     true_p = ax.hlines(
-        [population.size * population.p(group) for group in population],
+        p,
         [i-0.4 for i in indexes],
         [i+0.4 for i in indexes],
         colors=[Color(c).darken(10) for c in group_color.values()]
     )
 
-    ax.set_ylim(0, 1.1 * population.size * population.p(largest_group))
+    ax.set_ylim(0, 1.1 * population.p(largest_group))
+    ax.yaxis.set_major_formatter(PercentFormatter(1.0))
+
+    ax.set_xlim(0-0.5, len(population)-0.5)
+    ax.set_xticks(range(len(population)))
+    ax.set_xticklabels(population.groups)
 
     # pbar
 
-    pbar = progress.barh(0.5, 0, height=1, color='orange')[0]
+    pbar = progress.barh(0.5, 0, height=1, color='orange', animated=True)[0]
     progress.set_xlim(0, 1)
 
-    def update_errorbars(errorbars, bars):
-        # wtf matplotlib
-        # https://stackoverflow.com/questions/25210723/matplotlib-set-data-for-errorbar-plot
-        # https://stackoverflow.com/questions/21912197/setting-different-error-bar-colors-in-bar-plot-in-matplotlib
+    progress.set_title(title or f"Counting votes in packs of {voters//tallies}, {alpha = }")
 
-        current_vote_count = sum(bar.get_height() for bar in bars)
+    artists = [*bars, errorbars, caps, pbar]
 
-        for errorbar, bar, group in zip(errorbars, bars, population.groups):
-            ln, (erry_top, erry_bot), (bary,) = errorbar
+    def draw(running):
+        shares, margins = running.proportions, running.margins
 
-            err_pct = error(population.p(group), current_vote_count, N=size_limit, alpha=alpha)
-            err = err_pct * current_vote_count
+        for bar, share in zip(bars, shares.tolist()):
+            bar.set_height(share)
 
-            #ln.set_ydata(bar.get_height())
+        top, bot = shares + margins, shares - margins
+        errorbars.set_segments(np.stack([np.column_stack([indexes, top]), np.column_stack([indexes, bot])], axis=1))
+        caps.set_offsets(np.column_stack([indexes * 2, np.concatenate([top, bot])]))
 
-            top = bar.get_height() + err
-            bot = bar.get_height() - err
+        pbar.set_width(running.total/voters)
 
-            erry_top.set_ydata(top)
-            erry_bot.set_ydata(bot)
+        return artists
 
-            i = bary.get_segments()[0][0,0]
+    return fig, draw
 
-            bary.set_segments([[[i,top], [i, bot]]])
 
-    def init():
-        # useless unless blit is True
 
-        ax.set_xlim(0-0.5, len(population)-0.5)
+def plot_single_poll(population, group_color, voters=None, tallies=500, alpha=0.95, without_replacement=True, seed=0, store=None, counts=None, cache=None, workers=None, prefetch=None, save=False):
+    if voters is None: voters = population.size #100_000
 
-        ax.set_xticks(range(len(population)))
-        ax.set_xticklabels(population.groups)
+    if counts is None:
+        # the same tallies with or without the cache
+        if cache is not None:
+            tally = cache.tallies(population, voters, tallies, without_replacement=without_replacement, seed=seed)
+        else:
+            tally = Tally(population, voters, tallies, without_replacement=without_replacement, codes=True, rng=np.random.default_rng(seed))
 
-        return bars
+            if store or save:
+                tally = np.array(list(tally)).reshape(-1, len(population))
+        if store:
+            save_results(store, tally, population, kind="tallies", voters=voters, tallies=tallies, alpha=alpha, without_replacement=without_replacement, seed=seed)
+    else:
+        tally = counts
 
+    figure = (population, group_color, voters, tallies, alpha)
 
+    if save:
+        # every frame shows the votes counted so far
+        frames = [Accumulator(population, alpha, without_replacement, counts) for counts in np.cumsum(tally, axis=0)]
+        folder = create_folder_if_not_exists("figures")
+        export_animation(f"{folder / save}.webm", single_poll_figure, figure, frames, fps=20, workers=workers)
 
-    def update(tally):
-        for group in tally:
-            bar = bars[population.group_index[group]]
+    if prefetch is not None:
+        # simulate ahead in the background, and skip the frames it has not caught up with
+        tally = prefetch.feed(tally).ready()
 
-            bar.set_height(bar.get_height() + tally[group])
+    fig, draw = single_poll_figure(*figure)
+    running = Accumulator(population, alpha, without_replacement)
 
+    def init():
+        running.reset()
+        return draw(running)
 
-        update_errorbars(errors, bars)
+    def update(tally):
+        if tally is None: return []
+        return draw(running.add(tally))
 
-        current_vote_count = sum(bar.get_height() for bar in bars)
 
-        # are you fucking shitting me you fucking piece of shit mpl
-        # give me a hlines.set_ydata() function ffs
-        p_est = [population.p(group)*current_vote_count for group in population]
-        true_p.set_paths([
-            [[i-0.4, y], [i+0.4, y]] for i, y in enumerate(p_est)
-        ])
+    frame_length_ms = 10
+    # the frames are counted for an array, and only need a save_count when they are generated
+    frame_count = {} if isinstance(tally, np.ndarray) else dict(save_count=tallies)
+    anim = FuncAnimation(
+        fig, update, frames=tally, repeat=True, repeat_delay=1_000,
+        init_func=init, interval=frame_length_ms, blit=True, **frame_count,
+    )
+
+    plt.show()
 
-        pbar.set_width(current_vote_count/voters)
 
-        # vote_count = tuple(bar.get_height() for bar in bars)
-        # err = error(p=0.5, n=sum(vote_count), N=population.count, alpha=0.99)
-        # M = int(max(vote_count) * (1.1 + err))
-        # Mint = round(M, -int(log(M, 10))+1)
 
-        M = int(1.1*current_vote_count*population.p(largest_group))
+def plot_live(population, group_color, source, voters=None, alpha=0.95, without_replacement=True, interval=50):
+    """
+    Animate the live count of the district updates read from {source}
+    (host:port or a file being written), against the expected {population}.
+    The updates are ingested in the background, and every frame shows the
+    latest running count, however many updates arrived since the last one.
+    """
+    if voters is None: voters = population.size
 
-        ax.set_ylim(0, M)
-        ax.set_yticks(range(0, M, max(1, M//10)))
+    live = LiveCount(population, alpha, without_replacement)
+    start(source, live)
 
-        return bars
+    fig, draw = single_poll_figure(population, group_color, voters, 1, alpha, title=f"Counting votes live from {source}, {alpha = }")
 
+    def init():
+        running, _districts = live.snapshot()
+        return draw(running)
 
-    progress.set_title(f"Counting votes in packs of {voters//tallies}, {alpha = }")
+    def update(_frame):
+        if live.error is not None:
+            # keep the last count on screen, and say why it stopped
+            anim.event_source.stop()
+            fig.suptitle(f"Lost {source}: {live.error}", color="red")
+            fig.canvas.draw_idle()
+        return init()
 
-    frame_length_ms = 10
     anim = FuncAnimation(
-        fig, update, frames=tally, repeat=True, repeat_delay=1_000,
-        init_func=init, interval=frame_length_ms, blit=False, save_count=tallies,
+        fig, update, frames=count(), init_func=init,
+        interval=interval, blit=True, cache_frame_data=False,
     )
 
-    if save:
-        folder = create_folder_if_not_exists("figures")
-        anim.save(f"{folder / save}.webm", codec="png", extra_args=["-vcodec", "libvpx-vp9"], fps=20)
     plt.show()
 
 
-
-
 # ===
 
 
-def plot_polls(population, group_color, voters=None, polls=500, alpha=0.95, without_replacement=True, save=False):
-    if voters is None: voters = sum(population.weights)
+def plot_polls(population, group_color, voters=None, polls=500, alpha=0.95, without_replacement=True, workers=None, seed=0, store=None, counts=None, cache=None, density=False, save=False):
+    if voters is None: voters = population.size
     largest_group = max(population, key=lambda g: population[g])
 
     size_limit = population.size if without_replacement else inf
@@ -272,14 +359,12 @@ def plot_polls(population, group_color, voters=None, polls=500, alpha=0.95, with
 
     # ---
 
-    errors = [
-        voters * error(population.p(group), voters, N=size_limit, alpha=alpha)
-        for group in population
-    ]
+    p = population.probabilities
+    errors = voters * error(p, voters, N=size_limit, alpha=alpha)
     for i, color in enumerate(group_color.values()):
         ax.errorbar(
             i,
-            voters * population.weights[i]/population.size,
+            voters * p[i],
             yerr=errors[i],
             capsize=15,
             capthick=1,
@@ -288,16 +373,44 @@ def plot_polls(population, group_color, voters=None, polls=500, alpha=0.95, with
         )
 
     indexes = list(population.group_index.values())
-    for _poll in range(polls):
-        results = poll(population, voters, without_replacement=without_replacement)
 
+    if not density:
+        counts = poll_results(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache)
+        polls = len(counts)
+
+        # all polls in one collection, one row of segments per poll
         estimate_p = ax.hlines(
-            [results[group] for group in population],
-            [i-0.1 for i in indexes],
-            [i+0.1 for i in indexes],
-            colors=[Color(c).darken(10) for c in group_color.values()],
+            counts.ravel(),
+            [i-0.1 for i in indexes] * polls,
+            [i+0.1 for i in indexes] * polls,
+            colors=[Color(c).darken(10) for c in group_color.values()] * polls,
             alpha=0.2,
         )
+    else:
+        # results sharing a pixel row of the axes share a bin, and
+        # the results above the axes are all counted in the last bin
+        y_max = 1.1 * voters * (population.p(largest_group) + error(population.p(largest_group), voters, N=size_limit, alpha=0.99))
+        width = max(1, int(y_max / ax.get_window_extent().height))
+
+        histograms = poll_histograms(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache, width, int(y_max) + width)
+        polls = histograms[0].sum() if len(population) else 0
+
+        # one image per group, a row per bin between its lowest and highest result;
+        # k polls in a bin compound to an alpha of 1 - 0.8^k, exactly as k
+        # stacked 0.2 alpha lines would look
+        for i, (histogram, color) in enumerate(zip(histograms, group_color.values())):
+            bins = np.flatnonzero(histogram)
+            if not len(bins): continue
+            low, high = bins[0], bins[-1] + 1
+
+            image = np.empty((high - low, 1, 4))
+            image[...] = to_rgba(Color(color).darken(10))
+            image[:, 0, 3] = 1 - 0.8**histogram[low:high]
+
+            ax.imshow(
+                image, origin="lower", aspect="auto", interpolation="nearest",
+                extent=(i - 0.1, i + 0.1, low * width - 0.5, high * width - 0.5),
+            )
 
     ax.set_ylim(0, 1.1 * voters * (population.p(largest_group) + error(population.p(largest_group), voters, N=size_limit, alpha=0.99)))
 
@@ -317,12 +430,16 @@ def plot_polls(population, group_color, voters=None, polls=500, alpha=0.95, with
 # ===
 
 
-def plot_multiple_polls(population, group_color, voters=None, polls=500, alpha=0.95, without_replacement=True, save=False):
-    if voters is None: voters = sum(population.weights) #100_000
-
+def multiple_polls_figure(population, group_color, voters, counts, alpha=0.95, without_replacement=True):
+    """
+    Build the poll gathering figure for the polls {counts}, and return it with
+    draw(poll_count), which shows the first {poll_count} polls and returns
+    the artists it changed
+    """
     largest_group = max(population, key=lambda g: population[g])
 
     size_limit = population.size if without_replacement else inf
+    polls = len(counts)
 
 
     fig = plt.figure()
@@ -343,16 +460,13 @@ def plot_multiple_polls(population, group_color, voters=None, polls=500, alpha=0
 
 
     indexes = list(population.group_index.values())
-    heights = [0]*len(population)
 
-    errors = [
-        voters * error(population.p(group), voters, N=size_limit, alpha=alpha)
-        for group in population
-    ]
+    p = population.probabilities
+    errors = voters * error(p, voters, N=size_limit, alpha=alpha)
     for i, color in enumerate(group_color.values()):
         ax.errorbar(
             i,
-            voters * population.weights[i]/population.size,
+            voters * p[i],
             yerr=errors[i],
             capsize=15,
             capthick=1,
@@ -362,45 +476,85 @@ def plot_multiple_polls(population, group_color, voters=None, polls=500, alpha=0
 
     ax.set_ylim(0, 1.1 * voters * (population.p(largest_group) + error(population.p(largest_group), voters, N=size_limit, alpha=0.99)))
 
+    ax.set_xlim(0-0.5, len(population)-0.5)
+    ax.set_xticks(range(len(population)))
+    ax.set_xticklabels(population.groups)
+
+    # one segment per distinct (group, result) pair, allocated up front;
+    # k polls on the same segment compound to an alpha of 1 - 0.8^k
+    # (exactly as k stacked 0.2 alpha segments would look)
+
+    groups = len(population)
+    pairs, hits_of = np.unique(counts * groups + np.arange(groups), return_inverse=True)
+    hits_of = hits_of.reshape(counts.shape)
+    group, result = pairs % groups, pairs // groups
+
+    mark_color = np.array([to_rgba(Color(c).darken(10)) for c in group_color.values()])[group]
+    marks = LineCollection(
+        np.stack([
+            np.column_stack([group - 0.1, result]),
+            np.column_stack([group + 0.1, result]),
+        ], axis=1),
+        colors=mark_color, animated=True,
+    )
+    ax.add_collection(marks, autolim=False)
+
     # pbar
 
-    pbar = progress.barh(0.5, 0, height=1, color='orange')[0]
+    pbar = progress.barh(0.5, 0, height=1, color='orange', animated=True)[0]
     progress.set_xlim(0, 1)
 
+    progress.set_title(f"Gathering poll results, {alpha = }")
 
-    def init():
-        # useless unless blit is True
+    # the hits of the polls shown so far, counted on as the polls come in
+    hits = np.zeros(len(pairs), dtype=np.int64)
+    shown = 0
 
-        ax.set_xlim(0-0.5, len(population)-0.5)
+    def draw(poll_count):
+        nonlocal shown
+        if poll_count < shown:
+            # back to the start (init, or a repeat)
+            hits[:] = 0
+            shown = 0
+        np.add.at(hits, hits_of[shown:poll_count].ravel(), 1)
+        shown = poll_count
 
-        ax.set_xticks(range(len(population)))
-        ax.set_xticklabels(population.groups)
+        mark_color[:, 3] = 1 - 0.8**hits
+        marks.set_color(mark_color)
 
+        pbar.set_width(poll_count/polls)
 
+        return marks, pbar
 
-    def update(poll_count):
-        results = poll(population, voters, without_replacement=without_replacement)
+    return fig, draw
 
-        estimate_p = ax.hlines(
-            [results[group] for group in population],
-            [i-0.1 for i in indexes],
-            [i+0.1 for i in indexes],
-            colors=[Color(c).darken(10) for c in group_color.values()],
-            alpha=0.2,
-        )
 
-        pbar.set_width(poll_count/polls)
 
+def plot_multiple_polls(population, group_color, voters=None, polls=500, alpha=0.95, without_replacement=True, workers=None, seed=0, store=None, counts=None, cache=None, save=False):
+    if voters is None: voters = population.size #100_000
+
+    counts = poll_results(population, voters, polls, alpha, without_replacement, workers, seed, store, counts, cache)
+    polls = len(counts)
+
+    figure = (population, group_color, voters, counts, alpha, without_replacement)
+
+    if save:
+        folder = create_folder_if_not_exists("figures")
+        export_animation(f"{folder / save}.webm", multiple_polls_figure, figure, range(1, polls + 1), fps=20, workers=workers)
+
+    fig, draw = multiple_polls_figure(*figure)
+
+    def init():
+        return draw(0)
+
+    def update(poll_count):
+        return draw(poll_count + 1)
 
-    progress.set_title(f"Gathering poll results, {alpha = }")
 
     frame_length_ms = 10
     anim = FuncAnimation(
         fig, update, frames=range(polls), repeat=True, repeat_delay=1_000,
-        init_func=init, interval=frame_length_ms, blit=False, save_count=polls
+        init_func=init, interval=frame_length_ms, blit=True,
     )
 
-    if save:
-        folder = create_folder_if_not_exists("figures")
-        anim.save(f"{folder / save}.webm", codec="png", extra_args=["-vcodec", "libvpx-vp9"], fps=20)
     plt.show()
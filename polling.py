@@ -1,25 +1,73 @@
 """
-Complete the class and functions with docstrings
+Population model, vote sampling and polling error estimates
 
 Test your code with the test.py module
 """
 
 from collections import Counter
-from random import choices, sample
-from math import sqrt, log, inf
+from random import getrandbits, randrange
+from math import inf
+from types import MappingProxyType
+
+import numpy as np
+
+
+# bump whenever the numbers drawn for a given seed change, e.g. a new sampling engine
+ENGINE_VERSION = 1
 
 
 
 class Population:
+    """
+    An immutable mapping of groups to their number of members
+
+        Population({"a": 20, "b": 30})
+
+    The derived tuples and arrays are computed once, and populations
+    are hashable, so they can key caches.
+    """
+    __slots__ = (
+        "_weighted_groups", "_groups", "_weights", "_size", "_p", "_hash", "_alias",
+        "group_index", "weight_array", "probabilities", "cumulative_weights",
+    )
+
     def __init__(self, weighted_groups):
-        self._weighted_groups = weighted_groups
-        self.group_index = {group : i for i, group in enumerate(self.groups)}
-        self._size = sum(self.weights)
+        weighted_groups = dict(weighted_groups)
+        groups, weights = tuple(weighted_groups.keys()), tuple(weighted_groups.values())
+        size = sum(weights)
+
+        def freeze(array):
+            array.flags.writeable = False
+            return array
+
+        for name, value in dict(
+            _weighted_groups   = weighted_groups,
+            _groups            = groups,
+            _weights           = weights,
+            _size              = size,
+            _p                 = tuple(weight / size for weight in weights) if size else (0.0,) * len(weights),
+            _hash              = hash(tuple(weighted_groups.items())),
+            _alias             = None,
+            group_index        = MappingProxyType({group : i for i, group in enumerate(groups)}),
+            weight_array       = freeze(np.array(weights, dtype=np.int64)),
+            cumulative_weights = freeze(np.cumsum(weights, dtype=np.int64)),
+        ).items():
+            object.__setattr__(self, name, value)
+
+        object.__setattr__(self, "probabilities", freeze(np.array(self._p, dtype=float)))
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
 
     @property
     def groups(self):
-        return tuple(self._weighted_groups.keys())
+        return self._groups
 
 
     @property
@@ -29,6 +77,7 @@ class Population:
 
             Population({"a": 20, "b": 30}).weights == (20, 30)
         """
+        return self._weights
 
 
     @property
@@ -36,12 +85,40 @@ class Population:
         return self._size
 
 
+    @property
+    def alias(self):
+        """
+        The alias table of the population, built on first use
+        """
+        if self._alias is None: object.__setattr__(self, "_alias", Alias(self.weights))
+        return self._alias
+
+
+    @property
+    def code_dtype(self):
+        """
+        The smallest unsigned integer type holding a group code,
+        i.e. an index into population.groups
+        """
+        return np.min_scalar_type(max(len(self) - 1, 0))
+
+
+    def counter(self, counts):
+        """
+        Return the group counts ordered by group_index as a Counter of group names
+
+            Population({"a": 20, "b": 30}).counter([3, 7]) == {"a": 3, "b": 7}
+        """
+        return Counter({group: count for group, count in zip(self._groups, np.asarray(counts).tolist()) if count})
+
+
     def p(self, group):
         """
-        Return the probability of a member being ina  group
+        Return the probability of a member being in a group
 
             Population({"a": 20, "b": 30}).p("a") == 2/5
         """
+        return self._p[self.group_index[group]]
 
 
     def __getitem__(self, group):
@@ -58,10 +135,24 @@ class Population:
 
             len(Population({"a": 20, "b": 30})) == 2
         """
+        return len(self._groups)
 
 
     def __iter__(self):
-        return iter(self._weighted_groups.keys())
+        return iter(self._groups)
+
+
+    def __eq__(self, other):
+        if not isinstance(other, Population): return NotImplemented
+        return tuple(self._weighted_groups.items()) == tuple(other._weighted_groups.items())
+
+
+    def __hash__(self):
+        return self._hash
+
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._weighted_groups})"
 
 
     @property
@@ -69,30 +160,108 @@ class Population:
         return self._weighted_groups.copy()
 
 
+    def __reduce__(self):
+        # __dict__ is the group mapping, so pickle (e.g. for worker processes) by it
+        return Population, (self._weighted_groups,)
+
+
+
+def _rng(rng=None):
+    # numpy engines draw from a generator seeded off the global `random` state,
+    # so `random.seed` (as in __main__.py and test.py) keeps runs reproducible
+    if rng is None: rng = np.random.default_rng(getrandbits(64))
+    return rng
 
-def votes(population, size, without_replacement=True):
-    weights = list(population.weights)
 
-    assert size <= sum(weights)
 
+class _Fenwick:
     """
-    Yield {size} votes, either with or without replacement.
-    It can be easier to split this functionality into two
-    functions, in that case just write
+    Binary indexed tree over the group weights; drawing a group
+    and removing one of its members are both O(log groups)
+    """
+    def __init__(self, weights):
+        self._tree = [0, *weights]
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree): self._tree[parent] += self._tree[i]
+
+        self.total = sum(weights)
+        self._top = 1 << (len(weights).bit_length() - 1) if weights else 0
 
-        if without_replacement:
-            yield from _votes_without_replacements(population, size)
-        else:
-            yield from _votes_with_replacements(population, size)
 
-    The code for voting should look somewhat like this, with
-    a yield statement at the end
+    def add(self, i, delta):
+        self.total += delta
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
 
-        for _voter in range(size):
-            # code
-            yield vote
 
-    The resulting call should be something like this:
+    def find(self, r):
+        # index of the group covering the r-th remaining member, 0 <= r < total
+        tree, i, step = self._tree, 0, self._top
+        while step:
+            if i + step < len(tree) and tree[i + step] <= r:
+                i += step
+                r -= tree[i]
+            step >>= 1
+        return i
+
+
+
+class Alias:
+    """
+    Vose's alias table over the group weights, O(1) draws with replacement.
+
+    Group i is kept with probability prob[i]/total and otherwise replaced
+    by alias[i]; the table is built in integers, so it is exact.
+    """
+    def __init__(self, weights):
+        n, total = len(weights), sum(weights)
+        prob = [weight * n for weight in weights]
+        alias = list(range(n))
+
+        small = [i for i, p in enumerate(prob) if p < total]
+        large = [i for i, p in enumerate(prob) if p >= total]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            alias[s] = l
+            prob[l] -= total - prob[s]
+            (small if prob[l] < total else large).append(l)
+        for i in small + large: prob[i] = total
+
+        self.prob, self.alias, self.total = prob, alias, total
+        self._prob, self._alias = np.array(prob, dtype=np.int64), np.array(alias, dtype=np.int64)
+
+
+    def __len__(self):
+        return len(self.prob)
+
+
+    def draw(self):
+        i = randrange(len(self.prob))
+        return i if randrange(self.total) < self.prob[i] else self.alias[i]
+
+
+    def fill(self, out, rng=None):
+        """
+        Fill the integer array {out} with independent draws
+        """
+        rng = _rng(rng)
+        out[:] = rng.integers(len(self.prob), size=len(out))
+        replaced = rng.integers(self.total, size=len(out)) >= self._prob[out]
+        out[replaced] = self._alias[out[replaced]]
+        return out
+
+
+    def sample(self, size, rng=None):
+        return self.fill(np.empty(size, dtype=np.int64), rng)
+
+
+
+def votes(population, size, without_replacement=True, codes=False):
+    """
+    Yield {size} votes, either with or without replacement.
 
         for vote in votes(Population({"a": 20, "b": 30}), 5):
             print(vote)
@@ -101,19 +270,107 @@ def votes(population, size, without_replacement=True):
         # "b"
         # "a"
         # "b"
-        ¤ "b"
+        # "b"
+
+    With codes=True the votes are group codes (indexes into population.groups)
+    rather than group names.
+    """
+    assert size <= population.size
+
+    if without_replacement:
+        voting = _votes_without_replacement(population, size)
+    else:
+        voting = _votes_with_replacement(population, size)
+
+    if codes:
+        yield from voting
+    else:
+        groups = population.groups
+        for vote in voting: yield groups[vote]
+
+
+
+def _votes_with_replacement(population, size):
+    draw = population.alias.draw
+
+    for _voter in range(size):
+        yield draw()
 
-    The order of the votes are expected to be random,
-    but does not necessarily need to be so.
 
 
-    Hint 1: Gur pubvprf shapgvba sebz gur enaqbz yvoenel pna or hfrq
+def _votes_without_replacement(population, size):
+    remaining = _Fenwick(population.weights)
+
+    for _voter in range(size):
+        # draw a voter and remove them from valid voters
+        i = remaining.find(randrange(remaining.total))
+        remaining.add(i, -1)
+        yield i
+
+
+
+def ballots(population, size, without_replacement=True, rng=None):
+    """
+    Return {size} votes as an array of group codes of population.code_dtype
+
+        ballots(Population({"a": 20, "b": 30}), 5) == [0, 1, 0, 1, 1]
     """
+    rng = _rng(rng)
 
+    if without_replacement:
+        counts = _draw(population, size, None, without_replacement, rng)
+        codes = np.repeat(np.arange(len(population), dtype=population.code_dtype), counts)
+        rng.shuffle(codes)
+        return codes
 
+    return population.alias.sample(size, rng).astype(population.code_dtype)
 
 
-def poll(population, size, without_replacement=True):
+
+def votes_chunks(population, size, chunk_size, without_replacement=True, reuse=False, rng=None):
+    """
+    Yield {size} votes as arrays of at most {chunk_size} group codes,
+    which together are distributed like the votes() stream.
+
+    With reuse=True every chunk is written into the same buffer,
+    so a chunk is only valid until the next one is requested.
+    """
+    assert size <= population.size
+
+    rng = _rng(rng)
+    remaining = population.weight_array.copy()
+    buffer = np.empty(chunk_size, dtype=population.code_dtype)
+
+    for counted in range(0, size, chunk_size):
+        chunk = buffer[:min(chunk_size, size - counted)]
+
+        if without_replacement:
+            counts = rng.multivariate_hypergeometric(remaining, len(chunk), method="marginals")
+            remaining -= counts
+
+            ends = np.cumsum(counts)
+            for code in np.flatnonzero(counts).tolist():
+                chunk[ends[code] - counts[code] : ends[code]] = code
+            rng.shuffle(chunk)
+        else:
+            population.alias.fill(chunk, rng)
+
+        yield chunk
+
+        if not reuse: buffer = np.empty(chunk_size, dtype=population.code_dtype)
+
+
+
+def count(population, codes):
+    """
+    Return the number of votes for each group in an array of group codes,
+    ordered by population.group_index
+    """
+    return np.bincount(codes, minlength=len(population))
+
+
+
+def poll(population, size, without_replacement=True, codes=False):
     """
     Return the number of voters in each group in a poll.
     Note that the result is expected to be different in repeated calls
@@ -123,21 +380,191 @@ def poll(population, size, without_replacement=True):
         poll(Population({"a": 20, "b": 30}), 10) == {"a": 4, "b": 6}
         poll(Population({"a": 20, "b": 30}), 10) == {"a": 3, "b": 7}
 
+    The counts are drawn directly: a multinomial draw with replacement and
+    a multivariate hypergeometric draw without, i.e. O(groups) rather than
+    O(voters).
+
+    With codes=True the counts are returned as an array ordered by
+    population.group_index instead of a Counter.
+    """
+    counts = _draw(population, size, None, without_replacement)
+    return counts if codes else population.counter(counts)
+
+
+
+def poll_batch(population, size, polls, without_replacement=True, rng=None):
+    """
+    Return the results of {polls} polls as a (polls, groups) integer array,
+    with the columns ordered by population.group_index
+
+        poll_batch(Population({"a": 20, "b": 30}), 10, 3) == [[3, 7],
+                                                               [5, 5],
+                                                               [4, 6]]
 
-    Hint 1: Hfr gur ibgrf shapgvba qrsvarq nobir
-    Hint 2: Hfr Pbhagre sebz gur pbyyrpgvbaf yvoenel
+    {rng} is an optional numpy Generator to draw from instead of one
+    seeded off the global random state.
     """
+    return _draw(population, size, polls, without_replacement, rng)
 
 
 
-def Tally(population, N, n, without_replacement=True):
-    from itertools import islice
+def _draw(population, size, polls, without_replacement, rng=None):
+    assert size <= population.size
+    shape = () if polls is None else (polls,)
+    if not len(population): return np.zeros(shape + (0,), dtype=np.int64)
+
+    rng = _rng(rng)
+    if without_replacement:
+        return rng.multivariate_hypergeometric(population.weight_array, size, size=polls, method="marginals")
+    return rng.multinomial(size, population.probabilities, size=polls)
+
+
+
+def Tally(population, N, n, without_replacement=True, codes=False, rng=None):
+    """
+    Yield the counts of {N} votes split into tallies of ceil(N/n) votes.
+    Each tally is drawn as counts from the voters not yet counted
+    (or from the whole population with replacement), O(groups) per tally.
+
+        list(Tally(Population({"a": 20, "b": 30}), 10, 3)) == [{"a": 1, "b": 3},
+                                                               {"a": 2, "b": 2},
+                                                               {"a": 1, "b": 1}]
+
+    With codes=True each tally is an array ordered by population.group_index.
+    """
     from math import ceil
 
-    voting = votes(population, N, without_replacement)
+    assert N <= population.size
+    if not N: return
+
+    rng = _rng(rng)
+    remaining = population.weight_array.copy()
+
+    for counted in range(0, N, ceil(N/n)):
+        size = min(ceil(N/n), N - counted)
+
+        if without_replacement:
+            tally = rng.multivariate_hypergeometric(remaining, size, method="marginals")
+            remaining -= tally
+        else:
+            tally = rng.multinomial(size, population.probabilities)
+
+        yield tally if codes else population.counter(tally)
 
-    while tally := Counter(islice(voting, ceil(N/n))):
-        yield tally
+
+
+class Accumulator:
+    """
+    The running estimate of a count: the counts so far, ordered by
+    population.group_index, their total, the estimated proportions and
+    the error margin of each, error(p_hat, total, N, alpha).
+
+        running = Accumulator(population)
+        for tally in Tally(population, N, n, codes=True):
+            running.add(tally)
+            running.proportions, running.margins
+
+    Adding a tally is O(groups); the proportions and margins are
+    computed when read after a change.
+    """
+    def __init__(self, population, alpha=0.95, without_replacement=True, counts=None):
+        self.population = population
+        self.alpha = alpha
+        self.size_limit = population.size if without_replacement else inf
+
+        self.counts = np.zeros(len(population), dtype=np.int64)
+        self.total = 0
+        self._estimate = None
+
+        if counts is not None: self.add(counts)
+
+
+    def add(self, tally):
+        """
+        Add the counts of {tally}, an array ordered by group_index or a
+        {group: count} mapping; negative counts retract votes
+        """
+        if isinstance(tally, dict):
+            for group, count in tally.items():
+                self.counts[self.population.group_index[group]] += count
+                self.total += count
+        else:
+            tally = np.asarray(tally)
+            self.counts += tally
+            self.total += int(tally.sum())
+
+        self._estimate = None
+        return self
+
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self._estimate = None
+
+
+    def copy(self):
+        other = Accumulator.__new__(Accumulator)
+        other.__dict__.update(self.__dict__, counts=self.counts.copy())
+        return other
+
+
+    def _estimated(self):
+        if self._estimate is None:
+            if self.total:
+                proportions = self.counts / self.total
+                margins = error(proportions, self.total, N=self.size_limit, alpha=self.alpha)
+            else:
+                proportions = margins = np.zeros(len(self.population))
+            self._estimate = proportions, margins
+        return self._estimate
+
+
+    @property
+    def proportions(self):
+        return self._estimated()[0]
+
+
+    @property
+    def margins(self):
+        return self._estimated()[1]
+
+
+    def __repr__(self):
+        return f"Accumulator({self.population.counter(self.counts)!r}, total={self.total})"
+
+
+
+def adaptive_poll(population, margin, alpha=0.95, batch=100, budget=None, groups=None, without_replacement=True, codes=False, rng=None):
+    """
+    Poll voters in tallies of {batch} until the estimated error margin,
+    wilson_error(p_hat, n, N, alpha), of every group (or of each of {groups})
+    is below {margin}, or {budget} voters (the population by default) are asked.
+    Return the counts, as poll() does, and the number of voters asked
+
+        adaptive_poll(Population({"a": 2000, "b": 3000}), 0.05) == ({"a": 165, "b": 235}, 400)
+    """
+    from math import ceil
+
+    budget = population.size if budget is None else budget
+    assert budget <= population.size
+
+    indexes = slice(None) if groups is None else [population.group_index[group] for group in groups]
+    running = Accumulator(population, alpha, without_replacement)
+
+    # not the Wald margins of running.margins, which are 0 for a group no one
+    # was seen voting for yet, and would stop a poll of a rare group at once
+    for tally in Tally(population, budget, ceil(budget / batch), without_replacement, codes=True, rng=rng):
+        margins = wilson_error(running.add(tally).proportions[indexes], running.total, N=running.size_limit, alpha=alpha)
+        if (margins < margin).all(): break
+
+    return (running.counts if codes else population.counter(running.counts)), running.total
+
+
+
+def _scalar(x):
+    # plain floats for scalar arguments, arrays otherwise
+    return float(x) if np.ndim(x) == 0 else x
 
 
 
@@ -146,7 +573,17 @@ def sigma(p=0.5, n=1, N=inf):
     Return the population-corrected variance
 
         sigma() == 0.25
+
+    The arguments can be numpy arrays, which are broadcast together.
+    A scalar n = 0 or N = 1 raises ZeroDivisionError, as float arithmetic
+    would; within arrays they give inf or nan, without warnings.
     """
+    p, n, N = (np.asarray(x, dtype=float) for x in (p, n, N))
+    if (n.ndim == 0 and n == 0) or (N.ndim == 0 and N == 1):
+        raise ZeroDivisionError(f"sigma() of {n = } voters of a population of {N = }")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _scalar(np.sqrt(p * (1-p) / n) * np.sqrt(1 - (n-1)/(N-1)))
 
 
 def z_value(alpha=0.95, center=True):
@@ -154,10 +591,28 @@ def z_value(alpha=0.95, center=True):
     # http://m-hikari.com/ams/ams-2014/ams-85-88-2014/epureAMS85-88-2014.pdf
     # p. 4328
     # e.g. z_{alpha = 0.95, center=False} = 1.96
+    alpha = np.asarray(alpha, dtype=float)
     if center: alpha = (1 + alpha)/2
-    return 10/log(41) * log(1 - log(-log(alpha)/log(2))/log(22))
+    return _scalar(10/np.log(41) * np.log(1 - np.log(-np.log(alpha)/np.log(2))/np.log(22)))
 
 
 
 def error(p=0.5, n=1, N=inf, alpha=0.95):
-    return z_value(alpha) * sigma(p, n, N)
+    return _scalar(np.multiply(z_value(alpha), sigma(p, n, N)))
+
+
+
+def wilson_error(p=0.5, n=1, N=inf, alpha=0.95):
+    """
+    Return the population-corrected error margin of the Wilson score
+    interval around the estimate {p} of {n} votes: the distance from {p} to
+    the farther end of the interval. Unlike error() it is not 0 for p = 0 or 1.
+
+        wilson_error(0, 100) == 0.0370...
+    """
+    p, n, N = (np.asarray(x, dtype=float) for x in (p, n, N))
+    k = z_value(alpha)**2 * (1 - (n-1)/(N-1))
+
+    center = (p + k/(2*n)) / (1 + k/n)
+    half_width = np.sqrt(k) / (1 + k/n) * np.sqrt(p*(1-p)/n + k/(4*n**2))
+    return _scalar(np.abs(center - p) + half_width)
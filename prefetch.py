@@ -0,0 +1,119 @@
+"""
+Simulation running ahead of the animation
+
+A FrameQueue runs a simulation in a background thread, which pushes its
+results into a bounded queue, so that a slow simulation step never stalls
+the animation callback:
+
+    frames = FrameQueue(maxsize=64).feed(Tally(population, N, n, codes=True))
+
+    for tally in frames.ready():   # None while no tally is ready
+        ...
+
+    frames.stats()                 # depth, and whether rendering or simulation waited
+"""
+
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+
+_DONE = object()
+
+
+
+class FrameQueue:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.queue = Queue(maxsize)
+
+        self.produced = 0
+        self.consumed = 0
+        self.starved = 0    # frames without a ready result: simulation is the bottleneck
+        self.blocked = 0    # results waiting on a full queue: rendering is the bottleneck
+
+        self._stop = Event()
+        self._thread = None
+        self._error = None
+
+
+    def feed(self, results):
+        """
+        Start simulating {results}, an iterable, in a background thread
+        """
+        self._thread = Thread(target=self._produce, args=(iter(results),), daemon=True)
+        self._thread.start()
+        return self
+
+
+    def _produce(self, results):
+        # the consumer always gets the end of the results, and the
+        # exception of a failed simulation raised where it reads them
+        try:
+            for result in results:
+                if not self._put(result): return
+                self.produced += 1
+        except Exception as error:
+            self._error = error
+        finally:
+            self._put(_DONE)
+
+
+    def _done(self):
+        if self._error is not None: raise self._error
+
+
+    def _put(self, item):
+        # wait for room, but give up once the queue is closed
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            self.blocked += 1
+
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+
+    def ready(self):
+        """
+        Yield the results in order as they become ready, without waiting:
+        None stands in for a result that is not simulated yet. An exception
+        raised by the simulation is raised here after its last result.
+        """
+        while True:
+            try:
+                result = self.queue.get_nowait()
+            except Empty:
+                self.starved += 1
+                yield None
+                continue
+
+            if result is _DONE: return self._done()
+            self.consumed += 1
+            yield result
+
+
+    def __iter__(self):
+        # every result, waiting for each in turn
+        while (result := self.queue.get()) is not _DONE:
+            self.consumed += 1
+            yield result
+        self._done()
+
+
+    def close(self):
+        self._stop.set()
+
+
+    def stats(self):
+        return dict(depth=self.depth, maxsize=self.maxsize, produced=self.produced, consumed=self.consumed, starved=self.starved, blocked=self.blocked)
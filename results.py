@@ -0,0 +1,61 @@
+"""
+Binary store for simulation results
+
+A result file is an 8 byte magic, the length of a json header as 8 little
+endian bytes, the header, and from the next 64 byte boundary a C-ordered
+integer matrix of counts, one row per poll (or tally) and one column per group.
+The header records the population and the parameters of the simulation:
+
+    save("polls.bin", counts, population, kind="polls", voters=5000, alpha=0.95,
+         without_replacement=True, seed=0)
+
+    counts, meta = load("polls.bin")    # counts is a read-only memmap
+    meta["population"], meta["voters"], ...
+"""
+
+import numpy as np
+
+from polling import Population
+from container import write_header, read_header
+
+
+MAGIC = b"POLLRSLT"
+
+
+
+def create(path, shape, population, dtype=np.int64, **meta):
+    """
+    Create a result file of {shape} counts and return it as a writable memmap,
+    e.g. to simulate straight into the file
+    """
+    header = dict(meta, population=dict(zip(population.groups, population.weight_array.tolist())), shape=list(shape), dtype=np.dtype(dtype).str)
+
+    with open(path, "wb") as f:
+        offset = write_header(f, MAGIC, header)
+
+    return np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=tuple(shape))
+
+
+
+def save(path, counts, population, **meta):
+    """
+    Write the count matrix {counts} of a simulation of {population} to {path}
+    """
+    counts = np.asarray(counts)
+    out = create(path, counts.shape, population, counts.dtype, **meta)
+    out[...] = counts
+    out.flush()
+
+
+
+def load(path, mode="r"):
+    """
+    Return the counts of a result file as a memmap, without reading them,
+    and its metadata, with the population as a Population
+    """
+    meta, offset = read_header(path, MAGIC, "a result file")
+
+    shape, dtype = tuple(meta.pop("shape")), meta.pop("dtype")
+    meta["population"] = Population(meta["population"])
+
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape), meta
@@ -0,0 +1,191 @@
+"""
+Populations split into strata (e.g. districts) and stratified polls
+
+    population = StratifiedPopulation({
+        "Oslo"     : {"AP": 112_000, "H": 106_000, ...},
+        "Rogaland" : {"AP":  65_000, "H":  78_000, ...},
+        ...
+    })
+
+    counts = population.poll(1000, allocation="neyman")
+    population.estimate(counts), population.error(counts, alpha=0.95)
+"""
+
+import numpy as np
+
+from polling import Population, sigma, error, _rng
+
+
+
+class StratifiedPopulation:
+    """
+    A population made of strata, each with its own group weights.
+    Every stratum is a Population over the groups of all strata, and the
+    aggregate interface (groups, weights, size, p, ...) is that of the
+    national Population, so the polling functions accept it as well.
+    """
+    def __init__(self, strata):
+        strata = {name : dict(stratum) for name, stratum in strata.items()}
+        groups = tuple(dict.fromkeys(group for stratum in strata.values() for group in stratum))
+
+        self.strata = {
+            name : Population({group : stratum.get(group, 0) for group in groups})
+            for name, stratum in strata.items()
+        }
+        self.weight_matrix = np.array([stratum.weights for stratum in self.strata.values()], dtype=np.int64).reshape(-1, len(groups))
+        self.stratum_sizes = self.weight_matrix.sum(axis=1)
+
+        self.population = Population(dict(zip(groups, self.weight_matrix.sum(axis=0).tolist())))
+
+
+    def __getattr__(self, name):
+        # groups, weights, size, p, probabilities, alias, ...
+        if name.startswith("__") or name == "population": raise AttributeError(name)
+        return getattr(self.population, name)
+
+
+    def __getitem__(self, group):
+        return self.population[group]
+
+
+    def __contains__(self, group):
+        return group in self.population
+
+
+    def __len__(self):
+        return len(self.population)
+
+
+    def __iter__(self):
+        return iter(self.population)
+
+
+    def allocate(self, size, allocation="proportional", group=None, without_replacement=True):
+        """
+        Return the sample size of each stratum for a poll of {size} voters.
+
+            proportional : proportional to the stratum sizes
+            neyman       : proportional to the stratum sizes times their standard
+                           deviation, of {group} or averaged over all groups
+
+        Without replacement no stratum is allocated more voters than it has.
+        Every stratum with voters is allocated at least one (two when the poll
+        is large enough), as the estimate needs every stratum sampled and its
+        variance needs two votes from a stratum.
+        """
+        assert size <= self.size
+
+        strata = np.count_nonzero(self.stratum_sizes)
+        if size < strata:
+            raise ValueError(f"A stratified poll needs a voter from each of the {strata} strata, not {size}")
+
+        if allocation == "proportional":
+            shares = self.stratum_sizes.astype(float)
+        elif allocation == "neyman":
+            p = self.weight_matrix / np.maximum(self.stratum_sizes, 1)[:, None]
+            variance = p * (1 - p)
+            variance = variance.mean(axis=1) if group is None else variance[:, self.group_index[group]]
+            shares = self.stratum_sizes * np.sqrt(variance)
+            if not shares.any(): shares = self.stratum_sizes.astype(float)
+        else:
+            raise ValueError(f"Unknown allocation {allocation!r}")
+
+        limit = self.stratum_sizes if without_replacement else np.full(len(shares), size)
+        sizes = np.zeros(len(shares), dtype=np.int64)
+
+        # hand out the remaining voters until every stratum is full or all are allocated
+        while (left := size - sizes.sum()):
+            open_ = sizes < limit
+            target = np.where(open_, shares, 0)
+            target = left * target / target.sum() if target.any() else left * open_ / open_.sum()
+
+            # largest remainder rounding
+            add = np.floor(target).astype(np.int64)
+            order = np.argsort(add - target, kind="stable")[:left - add.sum()]
+            add[order] += 1
+
+            sizes = np.minimum(sizes + add, limit)
+
+        # move voters from the strata furthest over their share to the strata short of the minimum
+        minimum = np.minimum(self.stratum_sizes, 2 if size >= 2 * strata else 1)
+        excess = sizes - size * shares / shares.sum()
+        while (short := sizes < minimum).any():
+            donor = np.argmax(np.where(sizes > minimum, excess, -np.inf))
+            sizes[donor] -= 1
+            excess[donor] -= 1
+            sizes[np.argmax(short)] += 1
+
+        return sizes
+
+
+    def poll(self, size, allocation="proportional", without_replacement=True, group=None, polls=None, rng=None):
+        """
+        Return the counts of a stratified poll as a (strata, groups) integer array,
+        or a (polls, strata, groups) array of {polls} polls.
+        Each stratum is sampled in one batched draw.
+        """
+        rng = _rng(rng)
+        sizes = self.allocate(size, allocation, group, without_replacement)
+
+        shape = () if polls is None else (polls,)
+        counts = np.zeros(shape + self.weight_matrix.shape, dtype=np.int64)
+
+        for h, (weights, n) in enumerate(zip(self.weight_matrix, sizes.tolist())):
+            if not n: continue
+            if without_replacement:
+                counts[..., h, :] = rng.multivariate_hypergeometric(weights, n, size=polls, method="marginals")
+            else:
+                counts[..., h, :] = rng.multinomial(n, weights / weights.sum(), size=polls)
+
+        return counts
+
+
+    def _stratum_estimates(self, counts):
+        n = counts.sum(axis=-1, keepdims=True)
+        return counts / np.maximum(n, 1), n, self.stratum_sizes[:, None] / self.size
+
+
+    def estimate(self, counts):
+        """
+        Return the estimated proportion of each group from the counts of a stratified poll
+        """
+        p, n, W = self._stratum_estimates(counts)
+        return (W * p).sum(axis=-2)
+
+
+    def sigma(self, counts, without_replacement=True):
+        """
+        Return the standard deviation of the stratified estimate of each group,
+        combining sigma() of each sampled stratum. It is inf when a stratum
+        with voters left unpolled has fewer than two votes to estimate its variance from.
+        """
+        p, n, W = self._stratum_estimates(counts)
+        N = self.stratum_sizes[:, None] if without_replacement else np.inf
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            unknown = np.where((n < N) & (W > 0), np.inf, 0)
+            variance = np.where(n > 1, W**2 * sigma(p, n, N)**2, unknown)
+        return np.sqrt(variance.sum(axis=-2))
+
+
+    def effective_size(self, counts, without_replacement=True):
+        """
+        Return the simple random sample size with the same variance as the
+        stratified estimate, i.e. the n for which error(p, n) matches it
+        """
+        p = self.estimate(counts)
+        variance = self.sigma(counts, without_replacement)**2
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(variance > 0, p * (1 - p) / variance, np.inf)
+
+
+    def error(self, counts, alpha=0.95, without_replacement=True):
+        """
+        Return the error margin of the stratified estimate of each group
+        """
+        n = self.effective_size(counts, without_replacement)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            margins = error(self.estimate(counts), n, alpha=alpha)
+        return np.where(np.isfinite(n), margins, 0.0)
@@ -0,0 +1,116 @@
+"""
+Run a grid of poll simulations in one process and tabulate the results
+
+    python sweep.py -v 1000 5000 -a 0.9 0.95 -r both -p 600 -o sweep.csv
+
+Populations default to the 2017 Storting election; more can be given as
+json files of {group: weight}, e.g. -P storting=storting.json
+"""
+
+from math import inf
+from time import perf_counter
+
+import numpy as np
+
+from polling import error
+from montecarlo import run_polls
+
+
+
+def sweep(populations, voters, alphas=(0.95,), replacement=(False,), polls=600, seed=0, workers=1):
+    """
+    Yield one row per population, replacement, voters, alpha and group with
+
+        coverage           : the share of polls whose estimate p_hat is within
+                             error(p_hat, ...), the margin the poll reports, of the true proportion
+        mae                : the mean absolute error of the estimated proportion
+        simulation_seconds : the time spent simulating the polls of the grid cell
+        evaluation_seconds : the time spent evaluating them for this alpha
+
+    The polls of a grid cell are simulated once and evaluated for every alpha.
+    """
+    for name, population in populations.items():
+        p = population.probabilities
+
+        for replace in replacement:
+            size_limit = inf if replace else population.size
+
+            for n in voters:
+                start = perf_counter()
+                results = run_polls(population, n, polls, without_replacement=not replace, seed=seed, workers=workers)
+                p_hat = results / n
+                deviation = np.abs(p_hat - p)
+                mae = deviation.mean(axis=0)
+                simulated = perf_counter() - start
+
+                for alpha in alphas:
+                    start = perf_counter()
+                    margins = error(p_hat, n, N=size_limit, alpha=alpha)
+                    coverage = (deviation <= margins).mean(axis=0)
+                    evaluated = perf_counter() - start
+
+                    for i, group in enumerate(population.groups):
+                        yield dict(
+                            population = name,
+                            replace    = replace,
+                            voters     = n,
+                            alpha      = alpha,
+                            polls      = polls,
+                            group      = group,
+                            coverage   = float(coverage[i]),
+                            mae        = float(mae[i]),
+                            simulation_seconds = simulated,
+                            evaluation_seconds = evaluated,
+                        )
+
+
+
+def load_population(path):
+    import json
+    from polling import Population
+
+    with open(path) as f:
+        return Population(json.load(f))
+
+
+
+if __name__ == "__main__":
+    import csv
+    import sys
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+
+    parser.add_argument("-S", "--seed", default=0, type=int, help="Set seed")
+    parser.add_argument("-P", "--population", default=[], nargs="*", help="Populations as name=path.json")
+    parser.add_argument("-v", "--voters", default=[5000], type=int, nargs="*", help="Numbers of voters in poll")
+    parser.add_argument("-p", "--polls", default=600, type=int, help="Number of polls per grid cell")
+    parser.add_argument("-a", "--alpha", default=[0.95], type=float, nargs="*", help="Significance levels")
+    parser.add_argument("-r", "--replace", default="no", choices=["no", "yes", "both"], help="Sample with replacement")
+    parser.add_argument("-w", "--workers", default=1, type=int, help="Simulate polls over this many processes")
+    parser.add_argument("-o", "--output", default=None, help="Write the table to this csv file")
+
+    options = parser.parse_args()
+
+    if options.population:
+        populations = dict(spec.split("=", 1) for spec in options.population)
+        populations = {name: load_population(path) for name, path in populations.items()}
+    else:
+        from elections import parties
+        populations = {"storting_2017": parties}
+
+    replacement = {"no": (False,), "yes": (True,), "both": (False, True)}[options.replace]
+
+    rows = sweep(
+        populations, options.voters, options.alpha, replacement,
+        polls=options.polls, seed=options.seed, workers=options.workers,
+    )
+
+    output = open(options.output, "w", newline="") if options.output else sys.stdout
+    with output:
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(output, fieldnames=row.keys())
+                writer.writeheader()
+            writer.writerow(row)
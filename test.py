@@ -6,11 +6,19 @@ i.e to run the first three tests:
 """
 
 import argparse
+import os
 import unittest
 from random import seed
 
-from polling import poll, votes, Population, Tally, sigma
+from polling import poll, poll_batch, adaptive_poll, Accumulator, votes, votes_chunks, ballots, count, Population, Tally, Alias, sigma, error
 from collections import Counter
+from montecarlo import run_polls
+from sweep import sweep
+from electorate import Electorate
+from stratified import StratifiedPopulation
+import results
+from cache import SimulationCache
+from prefetch import FrameQueue
 
 # Parse command line arguments
 parser = argparse.ArgumentParser()
@@ -82,6 +90,30 @@ class Test_Population(unittest.TestCase):
             group in self.pop
 
 
+    def test_hashable(self):
+        self.assertEqual(self.pop, Population(self.pop_dict))
+        self.assertEqual(hash(self.pop), hash(Population(self.pop_dict)))
+        self.assertNotEqual(self.pop, self.empty)
+
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.pop.group_index = {}
+
+        self.pop_dict["a"] = 0
+        self.assertEqual(self.pop["a"], 10)
+
+        with self.assertRaises(TypeError):
+            self.pop.group_index["a"] = 2
+        self.assertEqual(self.pop.group_index["a"], 0)
+
+
+    def test_arrays(self):
+        self.assertEqual(self.pop.weight_array.tolist(), [10, 20, 30])
+        self.assertEqual(self.pop.cumulative_weights.tolist(), [10, 30, 60])
+        self.assertEqual(self.pop.probabilities.tolist(), [10/60, 20/60, 30/60])
+
+
 class Test_Voting(unittest.TestCase):
     def setUp(self):
         seed(options.seed)
@@ -106,6 +138,19 @@ class Test_Voting(unittest.TestCase):
             self.assertIn(vote, population.groups)
 
 
+    def test_all(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+            "d" : 1,
+            "e" : 0,
+        })
+
+        voting = Counter(self.votes(population, population.size))
+        self.assertEqual(voting, Counter(vars(population)))
+
+
 
 class Test_Tallying(unittest.TestCase):
     def setUp(self):
@@ -137,6 +182,19 @@ class Test_Tallying(unittest.TestCase):
         self.assertEqual(len(tallies), n)
 
 
+    def test_all(self):
+        population = Population({
+            "a" : 20,
+            "b" : 40,
+            "c" : 60,
+        })
+
+        for n in (1, 7, 120):
+            total = sum(self.Tally(population, population.size, n), Counter())
+
+            self.assertEqual(total, Counter(vars(population)))
+
+
 
 
 class Test_Poll_With_Replacement(unittest.TestCase):
@@ -252,6 +310,940 @@ class Test_Poll_Without_Replacement(unittest.TestCase):
         self.assertEqual(polling, Counter(vars(population)))
 
 
+    def test_bounded(self):
+        population = Population({
+            "a" : 1,
+            "b" : 2,
+            "c" : 3,
+        })
+
+        for _poll in range(100):
+            polling = self.poll(population, 5)
+
+            for group in polling:
+                self.assertLessEqual(polling[group], population[group])
+
+
+
+class Test_Poll_Batch(unittest.TestCase):
+    def setUp(self):
+        seed(options.seed)
+
+
+    def test_empty(self):
+        population = Population(dict())
+
+        self.assertEqual(poll_batch(population, 0, 4).shape, (4, 0))
+
+
+    def test_shape(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        for without_replacement in (True, False):
+            results = poll_batch(population, 15, 7, without_replacement=without_replacement)
+
+            self.assertEqual(results.shape, (7, 3))
+            self.assertEqual(results.sum(axis=1).tolist(), [15]*7)
+
+
+    def test_poll_all(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        results = poll_batch(population, population.size, 5)
+
+        self.assertEqual(results.tolist(), [list(population.weights)]*5)
+
+
+
+class Test_Alias(unittest.TestCase):
+    def setUp(self):
+        seed(options.seed)
+
+
+    def test_exact(self):
+        from fractions import Fraction
+
+        weights = (1, 0, 3, 6, 13)
+        alias = Alias(weights)
+
+        n = len(weights)
+        mass = [Fraction(0)]*n
+        for i in range(n):
+            mass[i] += Fraction(alias.prob[i], alias.total * n)
+            mass[alias.alias[i]] += Fraction(alias.total - alias.prob[i], alias.total * n)
+
+        self.assertEqual(mass, [Fraction(w, sum(weights)) for w in weights])
+
+
+    def test_cached(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        self.assertIs(population.alias, population.alias)
+
+
+    def test_fill(self):
+        import numpy as np
+
+        alias = Alias((10, 0, 30))
+        buffer = np.full(1000, -1)
+
+        self.assertIs(alias.fill(buffer), buffer)
+        self.assertEqual(set(buffer.tolist()), {0, 2})
+
+
+
+class Test_Codes(unittest.TestCase):
+    def setUp(self):
+        seed(options.seed)
+
+        self.population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+
+    def test_votes(self):
+        for without_replacement in (True, False):
+            for vote in votes(self.population, 20, without_replacement, codes=True):
+                self.assertIn(vote, range(len(self.population)))
+
+
+    def test_ballots(self):
+        for without_replacement in (True, False):
+            codes = ballots(self.population, 20, without_replacement)
+
+            self.assertEqual(codes.dtype, self.population.code_dtype)
+            self.assertEqual(len(codes), 20)
+
+        codes = ballots(self.population, self.population.size)
+        self.assertEqual(self.population.counter(count(self.population, codes)), Counter(vars(self.population)))
+
+
+    def test_chunks(self):
+        for without_replacement in (True, False):
+            chunks = list(votes_chunks(self.population, 50, 15, without_replacement))
+
+            self.assertEqual([len(chunk) for chunk in chunks], [15, 15, 15, 5])
+
+        chunks = [chunk.copy() for chunk in votes_chunks(self.population, self.population.size, 7, reuse=True)]
+        counts = sum(count(self.population, chunk) for chunk in chunks)
+
+        self.assertEqual(counts.tolist(), list(self.population.weights))
+
+
+    def test_poll(self):
+        counts = poll(self.population, self.population.size, codes=True)
+
+        self.assertEqual(counts.tolist(), list(self.population.weights))
+
+
+    def test_tally(self):
+        tallies = list(Tally(self.population, 60, 7, codes=True))
+
+        self.assertEqual(sum(tallies).tolist(), list(self.population.weights))
+
+
+
+class Test_Electorate(unittest.TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        import numpy as np
+
+        seed(options.seed)
+
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+        self.party = np.array([0, 1, 1, 2, 2, 2] * 10, dtype=np.uint8)
+        self.region = np.arange(60, dtype=np.uint16) % 4
+
+        Electorate.write(self.path, ("a", "b", "c"), dict(party=self.party, region=self.region))
+        self.electorate = Electorate(self.path)
+
+
+    def test_population(self):
+        self.assertEqual(self.electorate.size, 60)
+        self.assertEqual(self.electorate.groups, ("a", "b", "c"))
+        self.assertEqual(self.electorate.weights, (10, 20, 30))
+        self.assertEqual(self.electorate.p("a"), 10/60)
+
+
+    def test_columns(self):
+        self.assertEqual(self.electorate.columns["party"].tolist(), self.party.tolist())
+        self.assertEqual(self.electorate.columns["region"].tolist(), self.region.tolist())
+
+
+    def test_poll(self):
+        self.assertEqual(poll(self.electorate, 60), Counter({"a" : 10, "b" : 20, "c" : 30}))
+        self.assertEqual(self.electorate.poll(60).tolist(), [10, 20, 30])
+
+        table = self.electorate.poll(60, by="region")
+        self.assertEqual(table.shape, (4, 3))
+        self.assertEqual(table.sum(axis=0).tolist(), [10, 20, 30])
+
+
+    def test_sample(self):
+        rows = self.electorate.sample(60)
+        self.assertEqual(rows.tolist(), list(range(60)))
+
+        rows = self.electorate.sample(30, without_replacement=False)
+        self.assertEqual(len(rows), 30)
+
+
+
+class Test_Stratified(unittest.TestCase):
+    def setUp(self):
+        seed(options.seed)
+
+        self.population = StratifiedPopulation({
+            "x" : {"a" : 10, "b" : 20},
+            "y" : {"a" : 30, "c" : 40},
+            "z" : {"b" : 50, "c" : 50},
+        })
+
+
+    def test_population(self):
+        self.assertEqual(self.population.groups, ("a", "b", "c"))
+        self.assertEqual(self.population.weights, (40, 70, 90))
+        self.assertEqual(self.population.size, 200)
+
+
+    def test_allocate(self):
+        for allocation in ("proportional", "neyman"):
+            for size in (3, 5, 17, 150, 200):
+                sizes = self.population.allocate(size, allocation)
+
+                self.assertEqual(sizes.sum(), size)
+                self.assertTrue((sizes <= self.population.stratum_sizes).all())
+                self.assertTrue((sizes >= (1 if size < 6 else 2)).all())
+
+            with self.assertRaises(ValueError):
+                self.population.allocate(2, allocation)
+
+        self.assertEqual(self.population.allocate(20).tolist(), [3, 7, 10])
+
+        # no stratum of "c" has zero variance, but x has no "c" at all
+        self.assertEqual(self.population.allocate(150, "neyman", "c").tolist(), [2, 60, 88])
+
+
+    def test_neyman_estimate(self):
+        import numpy as np
+
+        # the strata without variance in the group are still sampled, so no group is left out of the estimate
+        counts = self.population.poll(150, allocation="neyman", group="c", polls=300, rng=np.random.default_rng(options.seed))
+        estimates = np.array([self.population.estimate(poll) for poll in counts])
+
+        self.assertTrue(np.allclose(estimates.sum(axis=1), 1))
+        self.assertTrue(np.allclose(estimates.mean(axis=0), self.population.probabilities, atol=0.01))
+
+
+    def test_single_votes(self):
+        import numpy as np
+
+        # a stratum sampled once gives no variance estimate, rather than a variance of 0
+        counts = self.population.poll(3)
+
+        self.assertTrue(np.isinf(self.population.sigma(counts)).all())
+        self.assertFalse(np.isfinite(self.population.error(counts)).any())
+
+
+    def test_poll(self):
+        counts = self.population.poll(50, allocation="neyman")
+
+        self.assertEqual(counts.shape, (3, 3))
+        self.assertEqual(counts.sum(axis=1).tolist(), self.population.allocate(50, "neyman").tolist())
+
+        counts = self.population.poll(50, polls=4, without_replacement=False)
+        self.assertEqual(counts.shape, (4, 3, 3))
+
+
+    def test_poll_all(self):
+        counts = self.population.poll(self.population.size)
+
+        self.assertEqual(counts.tolist(), self.population.weight_matrix.tolist())
+        for estimate, p in zip(self.population.estimate(counts), self.population.probabilities):
+            self.assertAlmostEqual(estimate, p)
+        self.assertEqual(self.population.error(counts).tolist(), [0, 0, 0])
+
+
+
+class Test_Results(unittest.TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+
+        seed(options.seed)
+
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+        self.population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+
+    def test_roundtrip(self):
+        counts = poll_batch(self.population, 15, 7)
+        results.save(self.path, counts, self.population, kind="polls", voters=15, alpha=0.9, seed=3)
+
+        loaded, meta = results.load(self.path)
+
+        self.assertEqual(loaded.tolist(), counts.tolist())
+        self.assertEqual(meta["population"], self.population)
+        self.assertEqual(meta["voters"], 15)
+        self.assertEqual(meta["alpha"], 0.9)
+        self.assertEqual(meta["seed"], 3)
+
+
+    def test_create(self):
+        out = results.create(self.path, (25, 3), self.population, voters=15)
+        run_polls(self.population, 15, 25, seed=0, workers=1, block_size=4, out=out)
+        out.flush()
+
+        loaded, meta = results.load(self.path)
+
+        self.assertEqual(loaded.tolist(), run_polls(self.population, 15, 25, seed=0, workers=1, block_size=4).tolist())
+
+
+    def test_numpy_weights(self):
+        import numpy as np
+
+        # e.g. a population counted from an array
+        population = Population(dict(zip("abc", np.array([10, 20, 30]))))
+        results.save(self.path, poll_batch(population, 15, 7), population)
+
+        self.assertEqual(results.load(self.path)[1]["population"], self.population)
+
+
+    def test_magic(self):
+        results.save(self.path, poll_batch(self.population, 15, 7), self.population)
+
+        # the result and electorate files share a container, told apart by their magic
+        with self.assertRaisesRegex(ValueError, "is not an electorate file"):
+            Electorate(self.path)
+
+
+
+class Test_Cache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.cache = SimulationCache(directory.name)
+        self.population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+
+    def test_hits(self):
+        first = self.cache.poll_batch(self.population, 15, 7, seed=1)
+        second = self.cache.poll_batch(self.population, 15, 7, seed=1)
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(first.tolist(), second.tolist())
+
+        self.cache.poll_batch(self.population, 15, 7, seed=2)
+        self.cache.tallies(self.population, 60, 7, seed=1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+
+    def test_tallies(self):
+        tallies = self.cache.tallies(self.population, 60, 7)
+
+        self.assertEqual(tallies.sum(axis=0).tolist(), list(self.population.weights))
+        self.assertEqual(tallies.tolist(), self.cache.tallies(self.population, 60, 7).tolist())
+
+
+    def test_transparent(self):
+        import numpy as np
+
+        # the cache holds the same counts as simulating without it
+        tallies = Tally(self.population, 60, 7, codes=True, rng=np.random.default_rng(3))
+        self.assertEqual(self.cache.tallies(self.population, 60, 7, seed=3).tolist(), [tally.tolist() for tally in tallies])
+        self.assertEqual(self.cache.poll(self.population, 15, seed=3).tolist(), run_polls(self.population, 15, 1, True, seed=3, workers=1)[0].tolist())
+
+
+    def test_numpy_weights(self):
+        import numpy as np
+
+        # the same key as for plain int weights
+        population = Population(dict(zip("abc", np.array([10, 20, 30]))))
+        self.cache.poll_batch(self.population, 15, 7, seed=1)
+        self.cache.poll_batch(population, 15, 7, seed=1)
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+
+    def test_evict(self):
+        import os
+
+        self.cache.poll_batch(self.population, 15, 7, seed=1)
+        self.cache.budget = self.cache.size
+        for path in self.cache.directory.glob("*.bin"): os.utime(path, (0, 0))
+
+        self.cache.poll_batch(self.population, 15, 7, seed=2)
+        self.cache.poll_batch(self.population, 15, 7, seed=2)
+        self.cache.poll_batch(self.population, 15, 7, seed=1)
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        self.assertLessEqual(self.cache.size, self.cache.budget)
+
+
+
+class Test_Prefetch(unittest.TestCase):
+    def test_order(self):
+        population = Population({
+            "a" : 20,
+            "b" : 40,
+            "c" : 60,
+        })
+
+        frames = FrameQueue(maxsize=2).feed(Tally(population, population.size, 7, codes=True))
+        tallies = [tally for tally in frames.ready() if tally is not None]
+
+        self.assertEqual(len(tallies), 7)
+        self.assertEqual(sum(tallies).tolist(), list(population.weights))
+        self.assertEqual(frames.stats()["consumed"], 7)
+
+
+    def test_bounded(self):
+        import time
+
+        frames = FrameQueue(maxsize=3).feed(range(10))
+        while frames.blocked == 0: time.sleep(0.001)
+
+        self.assertEqual(frames.depth, 3)
+        self.assertEqual(list(frames), list(range(10)))
+        self.assertEqual(frames.depth, 0)
+
+
+    def test_close(self):
+        frames = FrameQueue(maxsize=1).feed(iter(int, 1))
+        next(iter(frames))
+        frames.close()
+
+        frames._thread.join(timeout=1)
+        self.assertFalse(frames._thread.is_alive())
+
+
+    def test_error(self):
+        def failing():
+            yield 1
+            yield 2
+            raise ZeroDivisionError("in the simulation")
+
+        # the results before the exception arrive, and then the exception does, rather than waiting forever
+        for read in (FrameQueue.ready, FrameQueue.__iter__):
+            received = []
+            with self.assertRaisesRegex(ZeroDivisionError, "in the simulation"):
+                for result in read(FrameQueue(maxsize=2).feed(failing())):
+                    if result is not None: received.append(result)
+            self.assertEqual(received, [1, 2])
+
+
+
+class Test_Export(unittest.TestCase):
+    def test_frames(self):
+        import io
+        import matplotlib
+        matplotlib.use("Agg")
+        import numpy as np
+        from export import export_frames, frame_size
+        from plotting import multiple_polls_figure
+
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+        colors = ["#990014", "#d94abf", "#e51c30"]
+        counts = poll_batch(population, 15, 5)
+        args = (population, dict(zip(population, colors)), 15, counts)
+
+        width, height = frame_size(multiple_polls_figure, args)
+
+        serial, parallel = io.BytesIO(), io.BytesIO()
+        export_frames(multiple_polls_figure, args, range(1, 6), serial, workers=1, chunk_size=2)
+        export_frames(multiple_polls_figure, args, range(1, 6), parallel, workers=2, chunk_size=2)
+
+        self.assertEqual(len(serial.getvalue()), 5 * width * height * 4)
+        self.assertEqual(serial.getvalue(), parallel.getvalue())
+
+        # the polls fill in frame by frame
+        frames = np.frombuffer(serial.getvalue(), dtype=np.uint8).reshape(5, -1)
+        self.assertTrue((frames[0] != frames[-1]).any())
+
+
+    def test_draw(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib import pyplot as plt
+        from plotting import multiple_polls_figure
+
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+        colors = ["#990014", "#d94abf", "#e51c30"]
+        counts = poll_batch(population, 15, 9)
+        args = (population, dict(zip(population, colors)), 15, counts)
+
+        def colors_after(*poll_counts):
+            fig, draw = multiple_polls_figure(*args)
+            for poll_count in poll_counts:
+                marks, _pbar = draw(poll_count)
+            plt.close(fig)
+            return marks.get_colors().tolist()
+
+        # counting on from the shown polls, skipping ahead or starting over, draws as from scratch
+        self.assertEqual(colors_after(1, 2, 3, 4, 5, 6), colors_after(6))
+        self.assertEqual(colors_after(0, 3, 9, 0, 2, 5), colors_after(5))
+
+
+    def test_encoder_failure(self):
+        import tempfile
+        import matplotlib
+        matplotlib.use("Agg")
+        from unittest import mock
+        from export import export_animation
+        from plotting import multiple_polls_figure
+
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+        colors = ["#990014", "#d94abf", "#e51c30"]
+        args = (population, dict(zip(population, colors)), 15, poll_batch(population, 15, 50))
+
+        with tempfile.TemporaryDirectory() as directory:
+            # an ffmpeg that gives up before reading a frame
+            ffmpeg = os.path.join(directory, "ffmpeg")
+            with open(ffmpeg, "w") as f:
+                f.write("#!/bin/sh\necho 'Unknown encoder' >&2\nexit 8\n")
+            os.chmod(ffmpeg, 0o755)
+
+            with mock.patch.dict(os.environ, PATH=directory + os.pathsep + os.environ["PATH"]):
+                with self.assertRaisesRegex(RuntimeError, r"exit code 8\): Unknown encoder"):
+                    export_animation(os.path.join(directory, "out.webm"), multiple_polls_figure, args, range(1, 51), workers=1)
+
+
+
+class Test_Accumulator(unittest.TestCase):
+    def setUp(self):
+        self.population = Population({
+            "a" : 20,
+            "b" : 40,
+            "c" : 60,
+        })
+
+
+    def test_empty(self):
+        running = Accumulator(self.population)
+
+        self.assertEqual(running.total, 0)
+        self.assertEqual(running.proportions.tolist(), [0, 0, 0])
+        self.assertEqual(running.margins.tolist(), [0, 0, 0])
+
+
+    def test_tallies(self):
+        running = Accumulator(self.population, alpha=0.9)
+
+        for tally in Tally(self.population, 60, 7, codes=True):
+            running.add(tally)
+
+            self.assertEqual(running.total, running.counts.sum())
+            self.assertEqual(running.proportions.tolist(), (running.counts / running.total).tolist())
+            self.assertEqual(running.margins.tolist(), error(running.proportions, running.total, N=120, alpha=0.9).tolist())
+
+        self.assertEqual(running.total, 60)
+
+
+    def test_add(self):
+        running = Accumulator(self.population, without_replacement=False, counts=[1, 2, 3])
+        copy = running.copy()
+
+        running.add({"a" : 2, "c" : -1})
+        self.assertEqual((running.counts.tolist(), running.total), ([3, 2, 2], 7))
+        self.assertEqual(running.margins.tolist(), error(running.proportions, 7).tolist())
+        self.assertEqual((copy.counts.tolist(), copy.total), ([1, 2, 3], 6))
+
+        running.reset()
+        self.assertEqual((running.counts.tolist(), running.total), ([0, 0, 0], 0))
+
+
+
+class Test_Live(unittest.TestCase):
+    def setUp(self):
+        self.population = Population({
+            "a" : 200,
+            "b" : 400,
+            "c" : 600,
+        })
+
+
+    def test_replace(self):
+        from live import LiveCount
+
+        live = LiveCount(self.population)
+        live.update("x", {"a" : 1, "b" : 2})
+        live.update("y", {"c" : 3})
+        live.update("x", {"a" : 5, "b" : 2, "c" : 1})
+
+        running, districts = live.snapshot()
+        self.assertEqual(running.counts.tolist(), [5, 2, 4])
+        self.assertEqual((districts, live.updates), (2, 3))
+
+
+    def test_file(self):
+        import asyncio
+        import tempfile
+        from live import LiveCount, ingest, file_lines, updates
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.writelines(updates(self.population, 600, 7, steps=3))
+        self.addCleanup(os.unlink, f.name)
+
+        live = LiveCount(self.population)
+        asyncio.run(ingest(file_lines(f.name, follow=False), live))
+
+        running, districts = live.snapshot()
+        self.assertEqual((running.total, districts, live.updates), (600, 7, 21))
+
+
+    def test_refused(self):
+        import contextlib
+        import io
+        import socket
+        from live import LiveCount, start
+
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            port = s.getsockname()[1]
+
+        # nothing listens on the port: the error is kept for the display, not lost with the thread
+        live = LiveCount(self.population)
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            start(f"localhost:{port}", live).join(timeout=10)
+
+        self.assertIsInstance(live.error, ConnectionError)
+        self.assertIn("stopped ingesting", errors.getvalue())
+
+
+    def test_bad_updates(self):
+        import asyncio
+        import contextlib
+        import io
+        from live import LiveCount, ingest
+
+        async def lines():
+            for line in ['{"district": "x", "counts": {"a": 1}}\n', '{"district": "y", "coun\n', '{"district": "y", "counts": {"d": 2}}\n', '[]\n', '{"district": "z", "counts": {"c": 3}}\n']:
+                yield line
+
+        live = LiveCount(self.population)
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            asyncio.run(ingest(lines(), live))
+
+        # the bad lines are reported and skipped, and the good ones after them still counted
+        running, districts = live.snapshot()
+        self.assertEqual((running.counts.tolist(), districts), ([1, 0, 3], 2))
+        self.assertEqual(errors.getvalue().count("skipping update"), 3)
+
+
+    def test_socket(self):
+        import asyncio
+        import socket
+        import threading
+        import time
+        from live import LiveCount, serve, start
+
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            port = s.getsockname()[1]
+
+        feed = serve(self.population, self.population.size, 50, port=port, burst=20, interval=0.001)
+        threading.Thread(target=asyncio.run, args=(feed,), daemon=True).start()
+
+        live = LiveCount(self.population)
+        for _attempt in range(100):
+            try:
+                with socket.create_connection(("localhost", port)): break
+            except ConnectionRefusedError:
+                time.sleep(0.01)
+
+        start(f"localhost:{port}", live).join(timeout=10)
+
+        running, districts = live.snapshot()
+        self.assertEqual(running.counts.tolist(), list(self.population.weights))
+        self.assertEqual(districts, 50)
+
+
+
+class Test_Adaptive(unittest.TestCase):
+    def setUp(self):
+        seed(options.seed)
+
+        self.population = Population({
+            "a" : 2000,
+            "b" : 3000,
+            "c" : 100,
+        })
+
+
+    def test_margin(self):
+        counts, n = adaptive_poll(self.population, 0.05, batch=50, codes=True)
+
+        self.assertEqual(counts.sum(), n)
+        self.assertLess(n, self.population.size)
+        self.assertTrue((error(counts / n, n, N=self.population.size) < 0.05).all())
+
+
+    def test_budget(self):
+        counts, n = adaptive_poll(self.population, 0.001, budget=300)
+
+        self.assertEqual(n, 300)
+        self.assertEqual(sum(counts.values()), 300)
+
+
+    def test_groups(self):
+        _counts, n_all = adaptive_poll(self.population, 0.02, codes=True)
+        _counts, n_small = adaptive_poll(self.population, 0.02, groups=["c"], codes=True)
+
+        # the margin of a small group is reached sooner
+        self.assertLess(n_small, n_all)
+
+
+    def test_rare_group(self):
+        import numpy as np
+
+        population = Population({
+            "a" : 4950,
+            "b" : 4950,
+            "c" : 100,
+        })
+
+        # a 1% group is often not seen in the first batches, which must not
+        # count as a margin of 0: the true margin is met at the stopping size
+        for run in range(20):
+            _counts, n = adaptive_poll(population, 0.01, batch=50, groups=["c"], codes=True, rng=np.random.default_rng(run))
+            self.assertLessEqual(error(population.p("c"), n, N=population.size), 0.01)
+
+
+
+class Test_Instrument(unittest.TestCase):
+    def test_timed(self):
+        import instrument
+
+        timed_poll = instrument.timed(poll, "test.poll", "ballots", instrument.argument("size"))
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        self.assertEqual(sum(timed_poll(population, 5).values()), 5)
+        timed_poll(population, size=7)
+
+        summary = instrument.stages["test.poll"].summary()
+        self.assertEqual((summary["calls"], summary["work"], summary["unit"]), (2, 12, "ballots"))
+        self.assertGreater(summary["rate"], 0)
+
+
+    def test_generator(self):
+        import instrument
+
+        timed_tally = instrument.timed_generator(Tally, "test.Tally", "ballots", instrument.counted)
+        population = Population({
+            "a" : 20,
+            "b" : 40,
+            "c" : 60,
+        })
+
+        total = sum(timed_tally(population, population.size, 7), Counter())
+
+        self.assertEqual(total, Counter(vars(population)))
+        self.assertEqual(instrument.stages["test.Tally"].work, population.size)
+
+
+    def test_enable(self):
+        import json
+        import os
+        import subprocess
+        import sys
+        import tempfile
+
+        # in a fresh interpreter, as enable() rebinds the functions for good
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/stages.json"
+            script = (
+                "import instrument; from polling import poll; import polling;"
+                f"instrument.enable({output!r});"
+                "poll(polling.Population({'a': 10, 'b': 20}), 5); polling.poll(polling.Population({'a': 10}), 3)"
+            )
+            subprocess.run([sys.executable, "-c", script], check=True, env=dict(os.environ, MPLBACKEND="Agg"))
+
+            with open(output) as f:
+                stages = json.load(f)
+
+        self.assertEqual((stages["poll"]["calls"], stages["poll"]["work"]), (2, 8))
+
+
+
+class Test_Bench(unittest.TestCase):
+    def test_population(self):
+        from bench import population_of
+
+        population = population_of(50, 1000)
+
+        self.assertEqual(len(population), 50)
+        self.assertEqual(population.size, 1000)
+        self.assertTrue(all(weight > 0 for weight in population.weights))
+
+
+    def test_compare(self):
+        import bench
+
+        results = bench.run(groups=(3,), voters=(100,), replacement=(False,), keyword="sigma", min_time=0)
+        name, = results
+
+        self.assertEqual(results[name]["unit"], "groups/s")
+        self.assertEqual(bench.compare(results, results), {})
+
+        faster = {name : dict(results[name], seconds=results[name]["seconds"] / 2)}
+        self.assertEqual(bench.compare(results, faster, threshold=0.5), {name : (faster[name]["seconds"], results[name]["seconds"])})
+        self.assertEqual(bench.compare(results, faster, threshold=1.5), {})
+
+
+
+class Test_Monte_Carlo(unittest.TestCase):
+    def test_workers(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        for without_replacement in (True, False):
+            results = [
+                run_polls(population, 15, 25, without_replacement, seed=3, workers=workers, block_size=4)
+                for workers in (1, 3)
+            ]
+
+            self.assertEqual(results[0].shape, (25, 3))
+            self.assertTrue((results[0] == results[1]).all())
+
+
+    def test_seed(self):
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        results = [run_polls(population, 15, 25, seed=seed, workers=1) for seed in (0, 1)]
+
+        # Probabilistic test
+        self.assertFalse((results[0] == results[1]).all())
+
+
+    def test_simulate_polls(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        from plotting import simulate_polls
+
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        results = [simulate_polls(population, 15, 25, seed=3, workers=workers) for workers in (None, 1, 3)]
+
+        self.assertEqual(results[0].tolist(), results[1].tolist())
+        self.assertEqual(results[0].tolist(), results[2].tolist())
+
+
+    def test_histograms(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        import numpy as np
+        from plotting import poll_histograms
+
+        population = Population({
+            "a" : 10,
+            "b" : 20,
+            "c" : 30,
+        })
+
+        counts = run_polls(population, 15, 25, seed=3, workers=1, block_size=4)
+        histograms = poll_histograms(population, 15, 25, 0.95, True, 1, 3, None, None, None, block_size=4)
+
+        self.assertEqual(histograms.shape, (3, 16))
+        for group in range(3):
+            self.assertEqual(histograms[group].tolist(), np.bincount(counts[:, group], minlength=16).tolist())
+
+        # bins of 4 results, up to 8 and above
+        binned = poll_histograms(population, 15, 25, 0.95, True, 1, 3, None, counts, None, width=4, limit=8)
+
+        self.assertEqual(binned.shape, (3, 3))
+        self.assertEqual(binned[:, :2].tolist(), histograms[:, :8].reshape(3, 2, 4).sum(axis=2).tolist())
+        self.assertEqual(binned[:, 2].tolist(), histograms[:, 8:].sum(axis=1).tolist())
+
+
+
+class Test_Sweep(unittest.TestCase):
+    def test_grid(self):
+        populations = {
+            "abc" : Population({"a" : 10, "b" : 20, "c" : 30}),
+            "de"  : Population({"d" : 50, "e" : 50}),
+        }
+
+        rows = list(sweep(populations, voters=(5, 20), alphas=(0.9, 0.95), replacement=(False, True), polls=50))
+
+        self.assertEqual(len(rows), (3 + 2) * 2 * 2 * 2)
+        for row in rows:
+            self.assertTrue(0 <= row["coverage"] <= 1)
+            self.assertTrue(0 <= row["mae"] <= 1)
+
+
+    def test_coverage(self):
+        import numpy as np
+
+        population = Population({"a" : 10, "b" : 20, "c" : 30})
+        rows = list(sweep({"abc" : population}, voters=(20,), alphas=(0.9,), polls=50, seed=4))
+
+        # a poll covers the truth when it is within the margin the poll itself reports
+        p_hat = run_polls(population, 20, 50, seed=4, workers=1) / 20
+        covered = np.abs(p_hat - population.probabilities) <= error(p_hat, 20, N=population.size, alpha=0.9)
+
+        self.assertEqual([row["coverage"] for row in rows], covered.mean(axis=0).tolist())
+        for row in rows:
+            self.assertTrue(row["simulation_seconds"] >= 0 and row["evaluation_seconds"] >= 0)
+
+
 
 class Test_Variance(unittest.TestCase):
     def test_simple(self):
@@ -293,6 +1285,42 @@ class Test_Variance(unittest.TestCase):
             self.assertEqual(sigma(*args), result)
 
 
+    def test_array(self):
+        import numpy as np
+
+        p = np.array([0.1, 0.3, 0.5])
+        n = np.array([[3], [90]])
+        alpha = np.array([[0.9], [0.95]])
+
+        errors = error(p, n, 100, alpha)
+
+        self.assertEqual(errors.shape, (2, 3))
+        for i in range(2):
+            for j in range(3):
+                self.assertEqual(errors[i, j], error(p[j], n[i, 0], 100, alpha[i, 0]))
+
+        self.assertIs(type(sigma(0.5, 90, 100)), float)
+        self.assertIs(type(error(0.5, 90, 100)), float)
+
+
+    def test_zero_division(self):
+        import warnings
+        import numpy as np
+
+        for args in ((0.5, 0), (0.5, 1, 1), (0.0, 0, 20)):
+            with self.assertRaises(ZeroDivisionError):
+                sigma(*args)
+            with self.assertRaises(ZeroDivisionError):
+                error(*args)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            sigmas = sigma(np.array([0.5, 0.0, 0.5]), np.array([0, 0, 4]), np.array([20, 20, 1]))
+
+        self.assertEqual(sigmas[0], np.inf)
+        self.assertTrue(np.isnan(sigmas[1:]).all())
+
+
 
 tests = [
     Test_Population,
@@ -301,6 +1329,22 @@ tests = [
     Test_Poll_With_Replacement,
     Test_Poll_Without_Replacement,
     Test_Variance,
+    Test_Poll_Batch,
+    Test_Alias,
+    Test_Monte_Carlo,
+    Test_Sweep,
+    Test_Codes,
+    Test_Electorate,
+    Test_Stratified,
+    Test_Results,
+    Test_Cache,
+    Test_Export,
+    Test_Prefetch,
+    Test_Bench,
+    Test_Instrument,
+    Test_Adaptive,
+    Test_Live,
+    Test_Accumulator,
 ]
 tests = [tests[t-1] for t in options.test]
 